@@ -4,11 +4,32 @@ from dotenv import load_dotenv
 load_dotenv()
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "1"))
+
+# Caché de dos niveles (L1 en memoria del proceso + L2 Redis)
+CACHE_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "1024"))
+CACHE_BREAKER_FAILURES = int(os.getenv("CACHE_BREAKER_FAILURES", "3"))  # fallos seguidos para abrir
+CACHE_BREAKER_RESET_SECONDS = float(os.getenv("CACHE_BREAKER_RESET_SECONDS", "15"))
+
+# Ventana (ms) para agrupar peticiones concurrentes a Google en un solo batch HTTP
+GOOGLE_BATCH_WINDOW_MS = float(os.getenv("GOOGLE_BATCH_WINDOW_MS", "5"))
+# Google acepta hasta 50 sub-peticiones por batch en Calendar (Sheets permite más)
+GOOGLE_BATCH_MAX_SIZE = int(os.getenv("GOOGLE_BATCH_MAX_SIZE", "50"))
 
 # Para el MVP usamos un solo número (el tuyo) para salida
 GLOBAL_WA_TOKEN = os.getenv("WHATSAPP_TOKEN")
 GLOBAL_WA_PHONE_ID = os.getenv("WHATSAPP_PHONE_ID")
 
+# --- ÍNDICE DE DISPONIBILIDAD (Push de Google Calendar) ---
+# URL pública HTTPS de /webhook/calendar y token secreto del canal. Si falta alguno,
+# el índice se desactiva y check_availability sigue consultando Calendar en vivo.
+# docker-compose pasa "" cuando la variable no existe: se trata igual que no definida.
+CALENDAR_WEBHOOK_URL = os.getenv("CALENDAR_WEBHOOK_URL") or None
+CALENDAR_WEBHOOK_TOKEN = os.getenv("CALENDAR_WEBHOOK_TOKEN") or None
+AVAILABILITY_INDEX_DAYS = int(os.getenv("AVAILABILITY_INDEX_DAYS", "14"))
+
 TENANTS = {
     # REEMPLAZA ESTE ID CON EL QUE TE DE RETELL EN SU DASHBOARD
     "agent_89e9f56cb7d25e9f1da5e38d45": { 
@@ -27,7 +48,37 @@ TENANTS = {
         "owner_phone": "573232038102",  # Tu celular para recibir alertas
         "owner_email": "alyconr@hotmail.com",
         "appointment_buffer_hours": 1,
-        
+
+        # Calendarios de asesores adicionales a vigilar (además de calendar_id)
+        "advisor_calendars": [],
         
     }
-}
\ No newline at end of file
+}
+
+# --- DEDUPLICACIÓN DE TOOL CALLS (Retell reintenta cuando hay timeout) ---
+# ttl: segundos que se guarda el resultado para re-enviarlo a reintentos.
+# ttl = 0 -> solo se coalescen las llamadas concurrentes (sin replay).
+# La disponibilidad cambia al agendar, por eso no se re-envía.
+# El agendamiento solo se re-envía cuando fue exitoso (ver main.execute_tool).
+# Las funciones que no aparezcan aquí se ejecutan siempre sin deduplicar.
+TOOL_DEDUPE = {
+    "search_inventory": {"ttl": 60},
+    "check_calendar_availability": {"ttl": 0},
+    "book_appointment_and_notify": {"ttl": 600},
+}
+
+# --- CONVERSACIONES DE WHATSAPP ENTRANTES ---
+WA_INBOUND_WORKERS = int(os.getenv("WA_INBOUND_WORKERS", "8"))
+WA_CONVERSATION_HISTORY = int(os.getenv("WA_CONVERSATION_HISTORY", "50"))  # mensajes por remitente
+WA_CONVERSATION_TTL_SECONDS = int(os.getenv("WA_CONVERSATION_TTL_SECONDS", str(7 * 24 * 3600)))
+DEFAULT_COUNTRY_CODE = "57"
+
+# --- ENVÍOS MASIVOS DE WHATSAPP (campañas y recordatorios) ---
+# Throughput del tier de mensajería de Meta (80 msg/s por defecto, hasta 1000 al subir de tier)
+WA_MESSAGES_PER_SECOND = float(os.getenv("WA_MESSAGES_PER_SECOND", "80"))
+WA_BULK_CONCURRENCY = int(os.getenv("WA_BULK_CONCURRENCY", "20"))
+WA_REMINDER_TEMPLATE = "recordatorio_cita"
+REMINDER_OFFSETS_HOURS = [24, 1]
+
+# --- BÚSQUEDAS GUARDADAS (alertas de propiedades nuevas a leads anteriores) ---
+LISTING_ALERT_TEMPLATE = "alerta_nueva_propiedad"
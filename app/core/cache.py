@@ -0,0 +1,278 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from redis.exceptions import RedisError
+from app.core.redis_client import redis_client
+from app.config import (
+    CACHE_L1_MAX_ENTRIES,
+    CACHE_BREAKER_FAILURES,
+    CACHE_BREAKER_RESET_SECONDS,
+)
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Cachés creadas en este proceso (namespace -> TieredCache), para aplicar invalidaciones
+_caches = {}
+_background_tasks = set()
+
+
+class RedisUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Tras N fallos seguidos deja de llamar a Redis durante `reset_seconds`;
+    luego deja pasar UNA llamada de prueba (half-open). Si la prueba falla,
+    el circuito se vuelve a abrir; si funciona, se cierra.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if self.trial_in_flight or time.monotonic() - self.opened_at < self.reset_seconds:
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def success(self):
+        if self.opened_at is not None:
+            print("✅ Redis disponible de nuevo, cerrando circuito.")
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def abort_trial(self):
+        # La llamada de prueba terminó sin decir nada de Redis (ej. cancelada)
+        self.trial_in_flight = False
+
+    def failure(self):
+        self.trial_in_flight = False
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                print(f"⚠️ Redis no responde ({self.failures} fallos), sirviendo desde L1.")
+            self.opened_at = time.monotonic()
+
+
+# Un solo breaker por proceso: todas las cachés comparten el mismo Redis
+breaker = CircuitBreaker(CACHE_BREAKER_FAILURES, CACHE_BREAKER_RESET_SECONDS)
+
+
+async def call_redis(func, *args, **kwargs):
+    """
+    Ejecuta un comando de Redis pasando por el circuit breaker.
+    Lanza RedisUnavailable si Redis falla o el circuito está abierto.
+    """
+    if not breaker.allow():
+        raise RedisUnavailable("circuito abierto")
+    try:
+        result = await func(*args, **kwargs)
+    except (RedisError, OSError, asyncio.TimeoutError) as e:
+        breaker.failure()
+        raise RedisUnavailable(str(e)) from e
+    except BaseException:
+        breaker.abort_trial()
+        raise
+    breaker.success()
+    return result
+
+
+class TieredCache:
+    """
+    Caché de dos niveles:
+      L1: LRU en memoria del proceso (tamaño acotado, TTL).
+      L2: Redis, con llaves versionadas: cache:{namespace}:v{version}:{key}.
+
+    Invalidar todo un namespace sube la versión (las llaves viejas expiran solas)
+    y se avisa por pub/sub al resto de workers para que limpien su L1.
+    Si Redis no está disponible, se sirve lo que haya en L1 aunque esté vencido.
+    """
+
+    def __init__(self, namespace: str, ttl: int, l1_ttl: int = None, l1_max_entries: int = CACHE_L1_MAX_ENTRIES):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.l1_ttl = min(l1_ttl or ttl, ttl)
+        self.l1_max_entries = l1_max_entries
+        self.l1 = OrderedDict()  # key -> (expires_at, value)
+        self.version = None
+        _caches[namespace] = self
+
+    # --- L1 ---
+
+    def _l1_get(self, key, allow_stale=False):
+        entry = self.l1.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic() and not allow_stale:
+            return None
+        self.l1.move_to_end(key)
+        return value
+
+    def _l1_set(self, key, value):
+        self.l1[key] = (time.monotonic() + self.l1_ttl, value)
+        self.l1.move_to_end(key)
+        while len(self.l1) > self.l1_max_entries:
+            self.l1.popitem(last=False)
+
+    # --- L2 ---
+
+    async def _get_version(self):
+        if self.version is None:
+            version = await call_redis(redis_client.get, f"cache:ver:{self.namespace}")
+            self.version = int(version or 0)
+        return self.version
+
+    async def _redis_key(self, key):
+        return f"cache:{self.namespace}:v{await self._get_version()}:{key}"
+
+    # --- API ---
+
+    async def get(self, key: str):
+        value = self._l1_get(key)
+        if value is not None:
+            return value
+
+        try:
+            raw = await call_redis(redis_client.get, await self._redis_key(key))
+        except RedisUnavailable:
+            # Redis caído: mejor un dato vencido que fallar el tool call
+            return self._l1_get(key, allow_stale=True)
+
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        self._l1_set(key, value)
+        return value
+
+    async def get_many(self, keys: list):
+        """Lee varias llaves: primero L1 y las faltantes en un solo MGET."""
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._l1_get(key)
+            if value is not None:
+                found[key] = value
+            else:
+                missing.append(key)
+        if not missing:
+            return found
+
+        try:
+            redis_keys = [await self._redis_key(k) for k in missing]
+            raws = await call_redis(redis_client.mget, redis_keys)
+        except RedisUnavailable:
+            for key in missing:
+                value = self._l1_get(key, allow_stale=True)
+                if value is not None:
+                    found[key] = value
+            return found
+
+        for key, raw in zip(missing, raws):
+            if raw is not None:
+                value = json.loads(raw)
+                self._l1_set(key, value)
+                found[key] = value
+        return found
+
+    async def set(self, key: str, value):
+        self._l1_set(key, value)
+        try:
+            await call_redis(redis_client.setex, await self._redis_key(key), self.ttl, json.dumps(value, default=str))
+        except RedisUnavailable:
+            pass
+
+    async def set_many(self, values: dict):
+        """Escribe varias llaves en un pipeline (un solo round trip)."""
+        if not values:
+            return
+        for key, value in values.items():
+            self._l1_set(key, value)
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key, value in values.items():
+                pipe.setex(await self._redis_key(key), self.ttl, json.dumps(value, default=str))
+            await call_redis(pipe.execute)
+        except RedisUnavailable:
+            pass
+
+    async def invalidate(self, *keys):
+        """
+        Sin llaves: invalida todo el namespace (sube la versión).
+        Con llaves: borra solo esas. En ambos casos avisa a los demás workers.
+        """
+        if keys:
+            for key in keys:
+                self.l1.pop(key, None)
+        else:
+            self.l1.clear()
+
+        try:
+            if keys:
+                await call_redis(redis_client.delete, *[await self._redis_key(k) for k in keys])
+                message = {"ns": self.namespace, "keys": list(keys)}
+            else:
+                self.version = await call_redis(redis_client.incr, f"cache:ver:{self.namespace}")
+                message = {"ns": self.namespace, "version": self.version}
+            await call_redis(redis_client.publish, INVALIDATION_CHANNEL, json.dumps(message))
+        except RedisUnavailable:
+            print(f"⚠️ No se pudo propagar la invalidación de {self.namespace}")
+
+    def _apply_invalidation(self, message: dict):
+        if "keys" in message:
+            for key in message["keys"]:
+                self.l1.pop(key, None)
+        elif message.get("version") != self.version:
+            self.version = message.get("version")
+            self.l1.clear()
+
+
+# --- INVALIDACIÓN ENTRE WORKERS (pub/sub) ---
+
+async def _resync_versions():
+    # Tras una desconexión pudimos perder mensajes: comparar versiones con Redis
+    for cache in _caches.values():
+        version = int(await redis_client.get(f"cache:ver:{cache.namespace}") or 0)
+        if cache.version is not None and version != cache.version:
+            cache._apply_invalidation({"version": version})
+
+
+async def _invalidation_listener():
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            await _resync_versions()
+            while True:
+                # Timeout explícito: con listen() el socket_timeout corto del pool cortaría la conexión
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                data = json.loads(message["data"])
+                cache = _caches.get(data.get("ns"))
+                if cache:
+                    cache._apply_invalidation(data)
+        except Exception as e:
+            print(f"⚠️ Listener de invalidación desconectado: {e}")
+            await asyncio.sleep(CACHE_BREAKER_RESET_SECONDS)
+        finally:
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
+
+
+def start_invalidation_listener():
+    """Escucha invalidaciones de otros workers (llamar en el startup de la app)."""
+    task = asyncio.create_task(_invalidation_listener())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
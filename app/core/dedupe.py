@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import json
+from app.core.redis_client import redis_client
+from app.core.cache import call_redis, RedisUnavailable
+from app.config import TOOL_DEDUPE
+
+# Campos del payload que identifican la llamada pero no forman parte de los argumentos
+IDENTITY_KEYS = {"call", "call_id", "agent_id", "name", "tool_name"}
+
+# Llamadas en curso dentro de este proceso: clave -> Future con el resultado
+_in_flight = {}
+
+
+class ExecutionCancelled(Exception):
+    """La ejecución que atendía a los duplicados fue cancelada."""
+
+
+def get_call_id(payload: dict):
+    """
+    Retell envía el call_id plano o dentro del objeto 'call' según el tipo de payload.
+    Devuelve None si el payload no trae identidad de llamada.
+    """
+    call = payload.get("call")
+    if isinstance(call, dict) and call.get("call_id"):
+        return call["call_id"]
+    return payload.get("call_id")
+
+
+def args_hash(args: dict):
+    """
+    Hash canónico de los argumentos (orden de llaves y espacios no importan).
+    """
+    clean = {k: v for k, v in args.items() if k not in IDENTITY_KEYS}
+    canonical = json.dumps(
+        clean, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+async def run_once(func_name: str, call_id: str, args: dict, execute, cacheable=None):
+    """
+    Ejecuta `execute()` una sola vez por (call_id, función, argumentos).
+    - Duplicados concurrentes esperan el mismo Future en vuelo.
+    - Reintentos posteriores reciben el resultado guardado en Redis (TTL corto),
+      solo si hay call_id y `cacheable(result)` lo permite (por defecto, siempre).
+    Las funciones sin configuración en TOOL_DEDUPE se ejecutan directamente.
+    """
+    config = TOOL_DEDUPE.get(func_name)
+    if config is None:
+        return await execute()
+
+    key = f"dedupe:{func_name}:{call_id or 'sin_call_id'}:{args_hash(args)}"
+    # Sin call_id no sabemos si es un reintento o una llamada distinta: no hay replay
+    ttl = config.get("ttl", 0) if call_id else 0
+
+    # 1. ¿Hay una ejecución idéntica en curso? Esperamos su resultado.
+    while key in _in_flight:
+        print(f"♻️ Duplicado en vuelo, esperando resultado: {key}")
+        try:
+            return await asyncio.shield(_in_flight[key])
+        except ExecutionCancelled:
+            # La ejecución original se canceló: este duplicado la hace por su cuenta
+            continue
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+
+    try:
+        # 2. ¿Ya se completó hace poco? Re-enviamos el resultado guardado.
+        if ttl:
+            try:
+                cached = await call_redis(redis_client.get, key)
+            except RedisUnavailable as e:
+                print(f"⚠️ Dedupe sin Redis (lectura): {e}")
+                cached = None
+            if cached:
+                print(f"♻️ Reintento detectado, respondiendo desde caché: {key}")
+                result = json.loads(cached)
+                future.set_result(result)
+                return result
+
+        # 3. Primera vez: ejecutar y guardar
+        result = await execute()
+
+        if ttl and (cacheable is None or cacheable(result)):
+            try:
+                await call_redis(redis_client.setex, key, ttl, json.dumps(result, default=str))
+            except RedisUnavailable as e:
+                print(f"⚠️ Dedupe sin Redis (escritura): {e}")
+
+        future.set_result(result)
+        return result
+
+    except asyncio.CancelledError:
+        # CancelledError no es Exception: a los duplicados les llega una excepción normal
+        future.set_exception(ExecutionCancelled(key))
+        future.exception()
+        raise
+
+    except Exception as e:
+        future.set_exception(e)
+        # Evita el warning "Future exception was never retrieved" si nadie esperaba
+        future.exception()
+        raise
+
+    finally:
+        _in_flight.pop(key, None)
@@ -0,0 +1,94 @@
+import asyncio
+from app.core.google_auth import get_service
+from app.config import GOOGLE_BATCH_WINDOW_MS, GOOGLE_BATCH_MAX_SIZE
+
+# Peticiones pendientes por (creds_file, servicio, versión) -> [(build_request, future), ...]
+_pending = {}
+_background_tasks = set()
+
+
+async def execute(creds_file: str, service_name: str, version: str, build_request):
+    """
+    Encola una petición de Google y espera su respuesta.
+
+    `build_request` recibe el objeto service y devuelve el HttpRequest SIN ejecutar, ej:
+        lambda svc: svc.freebusy().query(body=body)
+
+    Las peticiones concurrentes del mismo tenant (mismo archivo de credenciales)
+    que lleguen dentro de GOOGLE_BATCH_WINDOW_MS viajan en un solo BatchHttpRequest.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    key = (creds_file, service_name, version)
+
+    queue = _pending.get(key)
+    if queue is None:
+        queue = _pending[key] = []
+        loop.call_later(GOOGLE_BATCH_WINDOW_MS / 1000, _flush, key, queue)
+
+    queue.append((build_request, future))
+
+    # Si el lote se llenó, lo enviamos sin esperar la ventana
+    if len(queue) >= GOOGLE_BATCH_MAX_SIZE:
+        _flush(key, queue)
+
+    return await future
+
+
+def _flush(key, queue):
+    # El timer puede dispararse después de que el lote ya salió por tamaño
+    if _pending.get(key) is not queue:
+        return
+    del _pending[key]
+    task = asyncio.create_task(_send(key, queue))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _send(key, items):
+    try:
+        results = await asyncio.to_thread(_execute_batch, key, items)
+    except Exception as e:
+        print(f"❌ Error Google Batch {key[1]}: {e}")
+        results = [(None, e)] * len(items)
+
+    # Repartir las respuestas a cada llamador
+    for (_, future), (response, exception) in zip(items, results):
+        if future.done():
+            continue
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(response)
+
+
+def _execute_batch(key, items):
+    """
+    Corre en un hilo: googleapiclient/httplib2 son síncronos.
+    Devuelve una lista [(response, exception), ...] en el mismo orden de `items`.
+    """
+    creds_file, service_name, version = key
+    service = get_service(service_name, version, creds_file)
+    results = [(None, None)] * len(items)
+
+    # Una sola petición: no vale la pena el sobre-costo del multipart
+    if len(items) == 1:
+        try:
+            results[0] = (items[0][0](service).execute(), None)
+        except Exception as e:
+            results[0] = (None, e)
+        return results
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    batch = service.new_batch_http_request(callback=callback)
+    for i, (build_request, _) in enumerate(items):
+        try:
+            batch.add(build_request(service), request_id=str(i))
+        except Exception as e:
+            results[i] = (None, e)
+
+    print(f"📦 Google Batch {service_name}: {len(items)} peticiones en 1 round trip")
+    batch.execute()
+    return results
@@ -1,4 +1,18 @@
 import redis.asyncio as redis
-from app.config import REDIS_URL
+from app.config import REDIS_URL, REDIS_MAX_CONNECTIONS, REDIS_SOCKET_TIMEOUT, REDIS_CONNECT_TIMEOUT
 
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
\ No newline at end of file
+# Pool con tope de conexiones: si se agota, espera un slot en vez de fallar.
+# Timeouts cortos para que una caída de Redis no congele los tool calls.
+connection_pool = redis.BlockingConnectionPool.from_url(
+    REDIS_URL,
+    decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_SOCKET_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+    socket_keepalive=True,
+    health_check_interval=30,
+    retry_on_timeout=True,
+)
+
+redis_client = redis.Redis(connection_pool=connection_pool)
@@ -0,0 +1,13 @@
+import unicodedata
+
+
+# --- FUNCIÓN HELPER PARA NORMALIZAR TEXTO (Tildes y Mayúsculas) ---
+def normalize_text(text):
+
+    if not isinstance(text, str):
+        return str(text)
+
+    # 1. Normalizar unicode (separar caracteres de sus tildes)
+    normalized = unicodedata.normalize('NFD', text)
+    # 2. Filtrar solo caracteres no-diacríticos y pasar a minúsculas
+    return "".join(c for c in normalized if unicodedata.category(c) != 'Mn').lower()
@@ -1,7 +1,9 @@
 from fastapi import FastAPI, BackgroundTasks, Request, Query, HTTPException
 from fastapi.responses import PlainTextResponse
-from app.services import inventory, calendar, notifications, crm
-from app.config import TENANTS
+from app.services import inventory, calendar, notifications, crm, availability_index, conversations, campaigns, saved_searches
+from app.config import TENANTS, CALENDAR_WEBHOOK_TOKEN
+from app.core import dedupe, cache
+import hmac
 import os
 
 app = FastAPI()
@@ -11,6 +13,14 @@ app = FastAPI()
 VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN", "inmobiliaria_token_secreto")
 
 
+@app.on_event("startup")
+async def start_background_workers():
+    cache.start_invalidation_listener()
+    availability_index.start()
+    conversations.start()
+    campaigns.start()
+
+
 @app.get("/webhook/whatsapp")
 async def verify_whatsapp_webhook(
     hub_mode: str = Query(alias="hub.mode"),
@@ -72,27 +82,57 @@ async def receive_whatsapp_message(request: Request):
 
         # --- CASO B: MENSAJE ENTRANTE (CLIENTE ESCRIBE) ---
         elif "messages" in value:
-            message = value["messages"][0]
-            sender = message.get("from")
-            msg_type = message.get("type")
+            names = conversations.contact_names(value.get("contacts", []))
 
-            print(f"📩 MENSAJE RECIBIDO de {sender} ({msg_type})")
+            for message in value["messages"]:
+                sender = message.get("from")
+                msg_type = message.get("type")
 
-            # Aquí procesarías el texto o audio
-            if msg_type == "text":
-                print(f"   Texto: {message['text']['body']}")
+                print(f"📩 MENSAJE RECIBIDO de {sender} ({msg_type})")
+
+                # Se guarda en Redis y se procesa en segundo plano, ordenado por remitente.
+                # Si no se pudo guardar, respondemos error para que Meta lo reenvíe.
+                try:
+                    await conversations.receive(message, names.get(sender))
+                except Exception as e:
+                    print(f"❌ No se pudo guardar el mensaje de {sender}: {e}")
+                    raise HTTPException(status_code=503, detail="Mensaje no almacenado")
 
             return {"status": "message_received"}
 
         else:
             return {"status": "ignored", "reason": "unknown_event"}
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         print(f"❌ Error procesando Webhook: {e}")
         # Siempre responder 200 a Meta o te bloquearán el webhook
         return {"status": "error", "detail": str(e)}
 
 
+@app.post("/webhook/calendar")
+async def receive_calendar_notification(request: Request, bg_tasks: BackgroundTasks):
+    """
+    Push de Google Calendar (events.watch). Google no envía el detalle del cambio,
+    solo los headers del canal; la sincronización se hace en segundo plano.
+    """
+    channel_id = request.headers.get("X-Goog-Channel-ID")
+    channel_token = request.headers.get("X-Goog-Channel-Token")
+    resource_state = request.headers.get("X-Goog-Resource-State")
+
+    if not CALENDAR_WEBHOOK_TOKEN or not hmac.compare_digest(channel_token or "", CALENDAR_WEBHOOK_TOKEN):
+        print(f"❌ Notificación de Calendar con token inválido (canal {channel_id})")
+        raise HTTPException(status_code=403, detail="Token inválido")
+
+    print(f"🗓️ Push de Calendar: canal={channel_id} | estado={resource_state}")
+    bg_tasks.add_task(availability_index.handle_notification, channel_id, resource_state)
+
+    # Google reintenta si no respondemos 2xx rápido
+    return {"status": "ok"}
+
+
 @app.post("/webhook")
 async def retell_webhook(request: Request, bg_tasks: BackgroundTasks):
     """
@@ -154,58 +194,87 @@ async def retell_webhook(request: Request, bg_tasks: BackgroundTasks):
 
         print(f"🔔 Ejecutando: {func_name} | Agent: {agent_id}")
 
-        # --- EJECUCIÓN DE FUNCIONES ---
+        # --- EJECUCIÓN DE FUNCIONES (con deduplicación de reintentos) ---
+        call_id = dedupe.get_call_id(payload)
+        return await dedupe.run_once(
+            func_name,
+            call_id,
+            args,
+            lambda: execute_tool(func_name, agent_id, args, bg_tasks),
+            cacheable=lambda result: is_replayable(func_name, result),
+        )
 
-        if func_name == "search_inventory":
-            return {"result": await inventory.search_inventory(agent_id, args)}
+    except Exception as e:
+        print(f"❌ ERROR FATAL: {str(e)}")
+        # import traceback
+        # traceback.print_exc()
+        return {"result": "Tuve un error técnico interno."}
 
-        if func_name == "check_calendar_availability":
-            fecha = args.get("fecha")
-            cal_id = args.get("asesor_calendar_id") or args.get("asesor_email")
 
-            if not fecha:
-                return {"result": "¿Para qué fecha te gustaría revisar?"}
-            return {
-                "result": await calendar.check_availability(agent_id, fecha, cal_id)
-            }
+BOOKING_OK_MESSAGE = "Listo, cita agendada y confirmación enviada."
 
-        if func_name == "book_appointment_and_notify":
-            if not args.get("cliente_telefono"):
-                return {"result": "Necesito confirmar tu número de WhatsApp."}
 
-            # Intento de Agendamiento
-            success = await calendar.create_event_and_lock(agent_id, args)
+def is_replayable(func_name: str, result: dict):
+    """
+    Un agendamiento fallido puede ser transitorio (ej: error al insertar);
+    solo el éxito se re-envía a los reintentos de Retell.
+    """
+    if func_name == "book_appointment_and_notify":
+        return result.get("result") == BOOKING_OK_MESSAGE
+    return True
 
-            if success:
-                bg_tasks.add_task(notifications.notify_all_parties, agent_id, args)
-                bg_tasks.add_task(crm.log_lead_bg, agent_id, args)
-                
-               
-                return {"result": "Listo, cita agendada y confirmación enviada."}
-            else:
-                try:
-                    full_date = args.get("fecha_hora_inicio", "")
-                    # Limpieza de fecha
-                    date_only = (
-                        full_date.split("T")[0] if "T" in full_date else full_date
-                    )
-                    cal_id = args.get("asesor_calendar_id")
-
-                    alternativas = await calendar.check_availability(
-                        agent_id, date_only, cal_id
-                    )
-                    return {
-                        "result": f"Ese horario ya está ocupado. {alternativas} ¿Alguna te sirve?"
-                    }
-                except:
-                    return {
-                        "result": "Ese horario ya está ocupado. ¿Te sirve otra hora?"
-                    }
-
-        return {"result": f"Función {func_name} no encontrada."}
 
-    except Exception as e:
-        print(f"❌ ERROR FATAL: {str(e)}")
-        # import traceback
-        # traceback.print_exc()
-        return {"result": "Tuve un error técnico interno."}
+async def execute_tool(func_name: str, agent_id: str, args: dict, bg_tasks: BackgroundTasks):
+    """
+    Ejecuta la función inferida. Separada del webhook para poder deduplicarla.
+    """
+    if func_name == "search_inventory":
+        bg_tasks.add_task(saved_searches.save_search, agent_id, args)
+        return {"result": await inventory.search_inventory(agent_id, args)}
+
+    if func_name == "check_calendar_availability":
+        fecha = args.get("fecha")
+        cal_id = args.get("asesor_calendar_id") or args.get("asesor_email")
+
+        if not fecha:
+            return {"result": "¿Para qué fecha te gustaría revisar?"}
+        return {
+            "result": await calendar.check_availability(agent_id, fecha, cal_id)
+        }
+
+    if func_name == "book_appointment_and_notify":
+        if not args.get("cliente_telefono"):
+            return {"result": "Necesito confirmar tu número de WhatsApp."}
+
+        # Intento de Agendamiento
+        success = await calendar.create_event_and_lock(agent_id, args)
+
+        if success:
+            bg_tasks.add_task(notifications.notify_all_parties, agent_id, args)
+            bg_tasks.add_task(crm.log_lead_bg, agent_id, args)
+            bg_tasks.add_task(conversations.link_voice_lead, agent_id, args)
+            bg_tasks.add_task(campaigns.schedule_booking_reminders, agent_id, args)
+            
+           
+            return {"result": BOOKING_OK_MESSAGE}
+        else:
+            try:
+                full_date = args.get("fecha_hora_inicio", "")
+                # Limpieza de fecha
+                date_only = (
+                    full_date.split("T")[0] if "T" in full_date else full_date
+                )
+                cal_id = args.get("asesor_calendar_id")
+
+                alternativas = await calendar.check_availability(
+                    agent_id, date_only, cal_id
+                )
+                return {
+                    "result": f"Ese horario ya está ocupado. {alternativas} ¿Alguna te sirve?"
+                }
+            except:
+                return {
+                    "result": "Ese horario ya está ocupado. ¿Te sirve otra hora?"
+                }
+
+    return {"result": f"Función {func_name} no encontrada."}
@@ -0,0 +1,487 @@
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+import pytz
+from googleapiclient.errors import HttpError
+from app.core.redis_client import redis_client
+from app.core.cache import TieredCache, call_redis, RedisUnavailable
+from app.core import google_batch
+from app.config import (
+    TENANTS,
+    CALENDAR_WEBHOOK_URL,
+    CALENDAR_WEBHOOK_TOKEN,
+    AVAILABILITY_INDEX_DAYS,
+)
+
+BOGOTA_TZ = pytz.timezone('America/Bogota')
+
+# Jornada de atención (la misma que ofrece el agente por teléfono)
+WORK_START_HOUR = 9
+WORK_END_HOUR = 17
+SLOT_MINUTES = 60
+
+# Eventos de varios días (vacaciones, etc.) se indexan como máximo este número de días
+MAX_EVENT_DAYS = 366
+
+# Google permite canales de hasta ~7 días en Calendar; renovamos con 1 día de margen
+CHANNEL_TTL_SECONDS = 7 * 24 * 3600
+RENEW_BEFORE_SECONDS = 24 * 3600
+MAINTENANCE_INTERVAL_SECONDS = 3600
+
+# Estructura en Redis (por calendario):
+#   availidx:calendar:{cal}      hash  agent_id, channel_id, resource_id, expiration
+#   availidx:channel:{channel}   str   calendar_id (para resolver notificaciones)
+#   availidx:events:{cal}        hash  event_id -> ["inicio_iso", "fin_iso"] (registro, solo HMGET)
+#   availidx:events:{cal}:{fecha} hash event_id -> ["inicio_iso", "fin_iso"] (eventos de ese día)
+#   availidx:sync:{cal}          str   syncToken de Calendar
+#   availidx:slots:{cal}:{fecha} zset  slot_iso -> timestamp (solo horarios libres)
+#   availidx:horizon:{cal}       str   última fecha indexada (expira con el canal)
+
+# Horarios libres ya calculados por "{calendario}:{fecha}" (índice o consulta en vivo)
+availability_cache = TieredCache("availability", ttl=60)
+
+_sync_locks = {}
+_background_tasks = set()
+
+
+def enabled():
+    """El índice solo se usa con URL pública y token reales configurados."""
+    return bool(CALENDAR_WEBHOOK_URL and CALENDAR_WEBHOOK_TOKEN)
+
+
+# --- CÁLCULO DE HORARIOS (compartido con calendar.check_availability) ---
+
+def day_bounds(target_date):
+    start_of_day = BOGOTA_TZ.localize(datetime.combine(target_date, datetime.min.time().replace(hour=WORK_START_HOUR)))
+    end_of_day = BOGOTA_TZ.localize(datetime.combine(target_date, datetime.min.time().replace(hour=WORK_END_HOUR)))
+    return start_of_day, end_of_day
+
+
+def free_slots(target_date, busy):
+    """
+    Devuelve los inicios de slot libres del día. `busy` es una lista de (inicio, fin).
+    """
+    start_of_day, end_of_day = day_bounds(target_date)
+    slots = []
+    current_slot = start_of_day
+
+    while current_slot < end_of_day:
+        slot_end = current_slot + timedelta(minutes=SLOT_MINUTES)
+        if not any(current_slot < busy_end and slot_end > busy_start for busy_start, busy_end in busy):
+            slots.append(current_slot)
+        current_slot = slot_end
+
+    return slots
+
+
+# --- LECTURA (lo que usa check_availability) ---
+
+async def get_free_slots(calendar_id: str, target_date):
+    """
+    Responde desde el índice precomputado.
+    Devuelve None si el índice no puede responder (calendario no vigilado,
+    fecha fuera del horizonte o Redis no disponible) -> consultar en vivo.
+    """
+    if not enabled():
+        return None
+
+    today = datetime.now(BOGOTA_TZ).date()
+    try:
+        horizon = await call_redis(redis_client.get, f"availidx:horizon:{calendar_id}")
+        if not horizon or target_date < today or target_date.isoformat() > horizon:
+            return None
+        members = await call_redis(
+            redis_client.zrange, f"availidx:slots:{calendar_id}:{target_date.isoformat()}", 0, -1
+        )
+    except RedisUnavailable as e:
+        print(f"⚠️ Índice de disponibilidad no disponible: {e}")
+        return None
+
+    return [datetime.fromisoformat(m) for m in members]
+
+
+# --- SINCRONIZACIÓN (full e incremental con syncToken) ---
+
+def _parse_dt(value):
+    # Python 3.10 no acepta el sufijo 'Z' en fromisoformat
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _event_interval(event):
+    """
+    Intervalo ocupado de un evento, o None si no bloquea la agenda
+    (cancelado o marcado como 'disponible', igual que freebusy).
+    """
+    if event.get('status') == 'cancelled' or event.get('transparency') == 'transparent':
+        return None
+
+    start, end = event.get('start', {}), event.get('end', {})
+    if 'dateTime' in start:
+        return _parse_dt(start['dateTime']), _parse_dt(end['dateTime'])
+    if 'date' in start:
+        # Evento de todo el día
+        return (
+            BOGOTA_TZ.localize(datetime.fromisoformat(start['date'])),
+            BOGOTA_TZ.localize(datetime.fromisoformat(end['date'])),
+        )
+    return None
+
+
+def _horizon():
+    today = datetime.now(BOGOTA_TZ).date()
+    return [today + timedelta(days=i) for i in range(AVAILABILITY_INDEX_DAYS)]
+
+
+def _dates_covered(start, end, horizon):
+    """Fechas del horizonte que toca el intervalo [start, end)."""
+    first = max(start.astimezone(BOGOTA_TZ).date(), horizon[0])
+    last = min((end - timedelta(microseconds=1)).astimezone(BOGOTA_TZ).date(), horizon[-1])
+    dates = []
+    while first <= last:
+        dates.append(first)
+        first += timedelta(days=1)
+    return dates
+
+
+def _event_dates(start, end):
+    """Fechas (desde hoy) en las que se guarda el evento, con tope de MAX_EVENT_DAYS."""
+    today = datetime.now(BOGOTA_TZ).date()
+    return _dates_covered(start, end, [today, today + timedelta(days=MAX_EVENT_DAYS - 1)])
+
+
+def _day_key(calendar_id: str, day):
+    return f"availidx:events:{calendar_id}:{day.isoformat()}"
+
+
+def _store_event(pipe, calendar_id: str, event_id: str, interval):
+    value = json.dumps([dt.isoformat() for dt in interval])
+    pipe.hset(f"availidx:events:{calendar_id}", event_id, value)
+    for day in _event_dates(*interval):
+        key = _day_key(calendar_id, day)
+        pipe.hset(key, event_id, value)
+        # El hash del día se borra solo un día después de pasada la fecha
+        expire_at = BOGOTA_TZ.localize(datetime.combine(day + timedelta(days=2), datetime.min.time()))
+        pipe.expireat(key, int(expire_at.timestamp()))
+
+
+def _unstore_event(pipe, calendar_id: str, event_id: str, interval):
+    pipe.hdel(f"availidx:events:{calendar_id}", event_id)
+    for day in _event_dates(*interval):
+        pipe.hdel(_day_key(calendar_id, day), event_id)
+
+
+async def _rebuild_days(calendar_id: str, days):
+    """
+    Recalcula los sorted sets de los días indicados leyendo solo los eventos
+    de esos días. No consulta a Google.
+    """
+    if not days:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    for day in days:
+        pipe.hvals(_day_key(calendar_id, day))
+    day_events = await pipe.execute()
+
+    pipe = redis_client.pipeline()
+    for day, values in zip(days, day_events):
+        intervals = [tuple(_parse_dt(v) for v in json.loads(value)) for value in values]
+        slots_key = f"availidx:slots:{calendar_id}:{day.isoformat()}"
+        slots = free_slots(day, intervals)
+        pipe.delete(slots_key)
+        if slots:
+            pipe.zadd(slots_key, {s.isoformat(): s.timestamp() for s in slots})
+            pipe.expire(slots_key, (AVAILABILITY_INDEX_DAYS + 1) * 86400)
+    await pipe.execute()
+
+    await availability_cache.invalidate(*[f"{calendar_id}:{day.isoformat()}" for day in days])
+
+
+async def _prune_registry(calendar_id: str):
+    """Saca del registro los eventos ya terminados (los hashes por día expiran solos)."""
+    events_key = f"availidx:events:{calendar_id}"
+    today_start = BOGOTA_TZ.localize(datetime.combine(datetime.now(BOGOTA_TZ).date(), datetime.min.time()))
+    stale_ids = []
+    async for event_id, value in redis_client.hscan_iter(events_key):
+        if _parse_dt(json.loads(value)[1]) <= today_start:
+            stale_ids.append(event_id)
+    if stale_ids:
+        await redis_client.hdel(events_key, *stale_ids)
+
+
+async def _publish_horizon(calendar_id: str, expiration: int):
+    # El índice solo es confiable mientras el canal esté vivo
+    ttl = int(expiration) - int(time.time())
+    if ttl > 0:
+        await redis_client.set(f"availidx:horizon:{calendar_id}", _horizon()[-1].isoformat(), ex=ttl)
+
+
+async def full_sync(agent_id: str, calendar_id: str):
+    tenant = TENANTS[agent_id]
+    today = datetime.now(BOGOTA_TZ).date()
+    time_min = BOGOTA_TZ.localize(datetime.combine(today, datetime.min.time())).isoformat()
+
+    events = {}
+    page_token = None
+    while True:
+        response = await google_batch.execute(
+            tenant['creds_file'], 'calendar', 'v3',
+            lambda svc: svc.events().list(
+                calendarId=calendar_id,
+                timeMin=time_min,
+                singleEvents=True,
+                maxResults=2500,
+                pageToken=page_token
+            )
+        )
+        for event in response.get('items', []):
+            interval = _event_interval(event)
+            if interval:
+                events[event['id']] = interval
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            sync_token = response.get('nextSyncToken')
+            break
+
+    # Borrar lo indexado antes (el registro dice en qué días estaba cada evento)
+    events_key = f"availidx:events:{calendar_id}"
+    previous = await redis_client.hgetall(events_key)
+
+    pipe = redis_client.pipeline()
+    for event_id, value in previous.items():
+        _unstore_event(pipe, calendar_id, event_id, [_parse_dt(v) for v in json.loads(value)])
+    pipe.delete(events_key)
+    for event_id, interval in events.items():
+        _store_event(pipe, calendar_id, event_id, interval)
+    if sync_token:
+        pipe.set(f"availidx:sync:{calendar_id}", sync_token)
+    await pipe.execute()
+
+    await _rebuild_days(calendar_id, _horizon())
+    print(f"🗓️ Índice completo para {calendar_id}: {len(events)} eventos")
+
+
+async def incremental_sync(agent_id: str, calendar_id: str):
+    """
+    Trae solo los eventos que cambiaron desde el último syncToken y
+    recalcula únicamente los días afectados (antes y después del cambio).
+    """
+    tenant = TENANTS[agent_id]
+    sync_key = f"availidx:sync:{calendar_id}"
+    sync_token = await redis_client.get(sync_key)
+    if not sync_token:
+        return await full_sync(agent_id, calendar_id)
+
+    changed = {}
+    page_token = None
+    while True:
+        try:
+            response = await google_batch.execute(
+                tenant['creds_file'], 'calendar', 'v3',
+                lambda svc: svc.events().list(
+                    calendarId=calendar_id,
+                    syncToken=sync_token,
+                    singleEvents=True,
+                    pageToken=page_token
+                )
+            )
+        except HttpError as e:
+            # 410 Gone: el syncToken expiró, toca sincronizar todo de nuevo
+            if e.resp.status == 410:
+                print(f"⚠️ syncToken expirado para {calendar_id}, resincronizando.")
+                return await full_sync(agent_id, calendar_id)
+            raise
+
+        for event in response.get('items', []):
+            changed[event['id']] = _event_interval(event)
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            next_sync_token = response.get('nextSyncToken')
+            break
+
+    if changed:
+        horizon = _horizon()
+        events_key = f"availidx:events:{calendar_id}"
+        event_ids = list(changed)
+        old_values = await redis_client.hmget(events_key, event_ids)
+
+        affected = set()
+        pipe = redis_client.pipeline()
+        for event_id, old_value in zip(event_ids, old_values):
+            if old_value:
+                old_interval = [_parse_dt(v) for v in json.loads(old_value)]
+                affected.update(_dates_covered(*old_interval, horizon))
+                _unstore_event(pipe, calendar_id, event_id, old_interval)
+
+            interval = changed[event_id]
+            if interval:
+                affected.update(_dates_covered(*interval, horizon))
+                _store_event(pipe, calendar_id, event_id, interval)
+        await pipe.execute()
+
+        if affected:
+            await _rebuild_days(calendar_id, sorted(affected))
+        print(f"🔄 {calendar_id}: {len(changed)} eventos cambiaron, {len(affected)} días recalculados")
+
+    if next_sync_token:
+        await redis_client.set(sync_key, next_sync_token)
+
+
+async def sync_calendar(calendar_id: str):
+    """Sincroniza un calendario vigilado. Serializado por calendario dentro del proceso."""
+    try:
+        info = await call_redis(redis_client.hgetall, f"availidx:calendar:{calendar_id}")
+    except RedisUnavailable as e:
+        print(f"⚠️ Sin Redis, no se sincroniza el índice {calendar_id}: {e}")
+        return
+    if not info:
+        return
+
+    lock = _sync_locks.setdefault(calendar_id, asyncio.Lock())
+    async with lock:
+        try:
+            await incremental_sync(info['agent_id'], calendar_id)
+        except Exception as e:
+            print(f"❌ Error sincronizando índice {calendar_id}: {e}")
+
+
+def schedule_sync(calendar_id: str):
+    """
+    Dispara una sincronización sin esperar la notificación de Google
+    (ej: justo después de crear una cita desde el agente).
+    """
+    if not enabled():
+        return
+    task = asyncio.create_task(sync_calendar(calendar_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def handle_notification(channel_id: str, resource_state: str):
+    """
+    Procesa un push de Calendar. Google solo avisa que algo cambió;
+    el detalle lo traemos con el syncToken.
+    """
+    try:
+        calendar_id = await call_redis(redis_client.get, f"availidx:channel:{channel_id}")
+    except RedisUnavailable as e:
+        # El índice queda desactualizado hasta el próximo push o el ciclo de mantenimiento
+        print(f"⚠️ Sin Redis, notificación de Calendar ignorada: {e}")
+        return
+    if not calendar_id:
+        print(f"⚠️ Notificación de canal desconocido o expirado: {channel_id}")
+        return
+
+    # 'sync' es el mensaje de confirmación al crear el canal
+    if resource_state == "sync":
+        return
+
+    await sync_calendar(calendar_id)
+
+
+# --- CANALES DE NOTIFICACIÓN (events.watch) Y RENOVACIÓN ---
+
+def watched_calendars(tenant):
+    calendars = [tenant['calendar_id']] + list(tenant.get('advisor_calendars', []))
+    return list(dict.fromkeys(calendars))
+
+
+async def register_channel(agent_id: str, calendar_id: str):
+    tenant = TENANTS[agent_id]
+    channel_id = uuid.uuid4().hex
+    body = {
+        "id": channel_id,
+        "type": "web_hook",
+        "address": CALENDAR_WEBHOOK_URL,
+        "token": CALENDAR_WEBHOOK_TOKEN,
+        "params": {"ttl": str(CHANNEL_TTL_SECONDS)},
+    }
+    response = await google_batch.execute(
+        tenant['creds_file'], 'calendar', 'v3',
+        lambda svc: svc.events().watch(calendarId=calendar_id, body=body)
+    )
+
+    # Google devuelve la expiración en milisegundos
+    expiration = int(response['expiration']) // 1000
+    info = {
+        "agent_id": agent_id,
+        "channel_id": channel_id,
+        "resource_id": response['resourceId'],
+        "expiration": str(expiration),
+    }
+
+    calendar_key = f"availidx:calendar:{calendar_id}"
+    old = await redis_client.hgetall(calendar_key)
+
+    pipe = redis_client.pipeline()
+    pipe.hset(calendar_key, mapping=info)
+    pipe.set(f"availidx:channel:{channel_id}", calendar_id, ex=max(expiration - int(time.time()), 60))
+    await pipe.execute()
+    print(f"📡 Canal de Calendar registrado para {calendar_id} (expira {datetime.fromtimestamp(expiration, BOGOTA_TZ)})")
+
+    # Detener el canal anterior para no recibir notificaciones duplicadas
+    if old.get('channel_id'):
+        try:
+            await google_batch.execute(
+                tenant['creds_file'], 'calendar', 'v3',
+                lambda svc: svc.channels().stop(body={"id": old['channel_id'], "resourceId": old['resource_id']})
+            )
+        except Exception as e:
+            print(f"⚠️ No se pudo detener el canal anterior {old['channel_id']}: {e}")
+        await redis_client.delete(f"availidx:channel:{old['channel_id']}")
+
+    return info
+
+
+async def maintain_channels():
+    """
+    Renueva canales próximos a expirar y desplaza la ventana de N días.
+    Solo un worker lo ejecuta a la vez (lock en Redis).
+    """
+    acquired = await redis_client.set(
+        "availidx:maintenance_lock", "1", nx=True, ex=MAINTENANCE_INTERVAL_SECONDS - 60
+    )
+    if not acquired:
+        return
+
+    for agent_id, tenant in TENANTS.items():
+        for calendar_id in watched_calendars(tenant):
+            try:
+                info = await redis_client.hgetall(f"availidx:calendar:{calendar_id}")
+                if not info or int(info['expiration']) - time.time() < RENEW_BEFORE_SECONDS:
+                    info = await register_channel(agent_id, calendar_id)
+
+                lock = _sync_locks.setdefault(calendar_id, asyncio.Lock())
+                async with lock:
+                    if await redis_client.exists(f"availidx:sync:{calendar_id}"):
+                        await incremental_sync(agent_id, calendar_id)
+                        # Día nuevo que entra a la ventana
+                        await _rebuild_days(calendar_id, _horizon())
+                    else:
+                        await full_sync(agent_id, calendar_id)
+
+                await _prune_registry(calendar_id)
+                await _publish_horizon(calendar_id, info['expiration'])
+            except Exception as e:
+                print(f"❌ Error manteniendo índice {calendar_id}: {e}")
+
+
+async def _maintenance_loop():
+    while True:
+        try:
+            await maintain_channels()
+        except Exception as e:
+            print(f"❌ Error en mantenimiento del índice: {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+
+def start():
+    """Arranca la renovación periódica de canales (llamar en el startup de la app)."""
+    if not enabled():
+        print("ℹ️ CALENDAR_WEBHOOK_URL o CALENDAR_WEBHOOK_TOKEN sin configurar: disponibilidad se consulta en vivo.")
+        return
+    task = asyncio.create_task(_maintenance_loop())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
@@ -1,10 +1,19 @@
+import asyncio
 from datetime import datetime, timedelta
 import pytz
 from app.config import TENANTS
-from app.core.google_auth import get_service
+from app.core import google_batch
+from app.services import availability_index
 
 BOGOTA_TZ = pytz.timezone('America/Bogota')
 
+# Un lock por calendario: verificar conflicto + insertar no debe intercalarse
+# (si no, dos reservas del mismo horario pasan ambas la verificación)
+_booking_locks = {}
+
+# Si el día pedido está lleno, cuántos días siguientes revisar para ofrecer alternativa
+FULL_DAY_LOOKAHEAD_DAYS = 3
+
 def get_target_calendar(tenant, calendar_id_arg):
     """
     Si viene un ID de calendario específico (ej: c_123...@group.calendar...), úsalo.
@@ -15,56 +24,87 @@ def get_target_calendar(tenant, calendar_id_arg):
         return calendar_id_arg.strip()
     return tenant['calendar_id']
 
-async def check_availability(agent_id: str, date_str: str, asesor_calendar_id: str = None):
-    tenant = TENANTS.get(agent_id)
-    if not tenant: return "Error config."
-
-    # Usamos el ID específico si viene
-    calendar_id = get_target_calendar(tenant, asesor_calendar_id)
+async def get_slots_for_days(tenant, calendar_id: str, dates: list):
+    """
+    Horarios libres de varios días de un calendario: {fecha: [datetime, ...]}.
+    1. Caché L1/Redis (un solo MGET para todos los días)
+    2. Índice precomputado (actualizado por push de Calendar)
+    3. Lo que falte, en vivo con UNA consulta a freebusy que cubre esos días
+    Devuelve None si la consulta en vivo falla.
+    """
+    keys = {day: f"{calendar_id}:{day.isoformat()}" for day in dates}
+    cached = await availability_index.availability_cache.get_many(list(keys.values()))
 
-    try:
-        service = get_service('calendar', 'v3', tenant['creds_file'])
-        
-        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-        start_of_day = BOGOTA_TZ.localize(datetime.combine(target_date, datetime.min.time().replace(hour=9)))
-        end_of_day = BOGOTA_TZ.localize(datetime.combine(target_date, datetime.min.time().replace(hour=17)))
+    result = {}
+    computed = {}
+    for day in dates:
+        if keys[day] in cached:
+            result[day] = [datetime.fromisoformat(s) for s in cached[keys[day]]]
+            continue
+        slots = await availability_index.get_free_slots(calendar_id, day)
+        if slots is not None:
+            result[day] = computed[day] = slots
 
+    missing = [day for day in dates if day not in result]
+    if missing:
         body = {
-            "timeMin": start_of_day.isoformat(),
-            "timeMax": end_of_day.isoformat(),
+            "timeMin": availability_index.day_bounds(min(missing))[0].isoformat(),
+            "timeMax": availability_index.day_bounds(max(missing))[1].isoformat(),
             "timeZone": "America/Bogota",
             "items": [{"id": calendar_id}]
         }
-        
+
         try:
-            events_result = service.freebusy().query(body=body).execute()
+            events_result = await google_batch.execute(
+                tenant['creds_file'], 'calendar', 'v3',
+                lambda svc: svc.freebusy().query(body=body)
+            )
             busy_slots = events_result['calendars'][calendar_id]['busy']
         except Exception as e:
             print(f"⚠️ Error permisos calendario {calendar_id}: {e}")
+            return None
+
+        busy = [(datetime.fromisoformat(b['start']), datetime.fromisoformat(b['end'])) for b in busy_slots]
+        for day in missing:
+            result[day] = computed[day] = availability_index.free_slots(day, busy)
+
+    await availability_index.availability_cache.set_many(
+        {keys[day]: [s.isoformat() for s in slots] for day, slots in computed.items()}
+    )
+    return result
+
+
+def _format_slots(slots):
+    return ', '.join(slot.strftime("%I:%M %p") for slot in slots[:3])
+
+
+async def check_availability(agent_id: str, date_str: str, asesor_calendar_id: str = None):
+    tenant = TENANTS.get(agent_id)
+    if not tenant: return "Error config."
+
+    # Usamos el ID específico si viene
+    calendar_id = get_target_calendar(tenant, asesor_calendar_id)
+
+    try:
+        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+
+        days = await get_slots_for_days(tenant, calendar_id, [target_date])
+        if days is None:
             # Fallback al calendario principal si falla el específico
             return "No pude sincronizar la agenda específica, intentemos una general."
 
-        available_slots = []
-        current_slot = start_of_day
-        
-        while current_slot < end_of_day:
-            slot_end = current_slot + timedelta(hours=1)
-            is_busy = False
-            for busy in busy_slots:
-                busy_start = datetime.fromisoformat(busy['start'])
-                busy_end = datetime.fromisoformat(busy['end'])
-                if (current_slot < busy_end) and (slot_end > busy_start):
-                    is_busy = True
-                    break
-            
-            if not is_busy:
-                available_slots.append(current_slot.strftime("%I:%M %p"))
-            current_slot += timedelta(hours=1)
-
-        if not available_slots:
-            return "Agenda llena para ese día."
-            
-        return f"Horarios disponibles: {', '.join(available_slots[:3])}."
+        slots = days[target_date]
+        if slots:
+            return f"Horarios disponibles: {_format_slots(slots)}."
+
+        # Día lleno: buscamos de una vez en los días siguientes para ofrecer alternativa
+        next_dates = [target_date + timedelta(days=i) for i in range(1, FULL_DAY_LOOKAHEAD_DAYS + 1)]
+        next_days = await get_slots_for_days(tenant, calendar_id, next_dates) or {}
+        for day in next_dates:
+            if next_days.get(day):
+                return f"Agenda llena para ese día. El {day.isoformat()} hay: {_format_slots(next_days[day])}."
+
+        return "Agenda llena para ese día."
 
     except Exception as e:
         print(f"❌ Error Availability: {e}")
@@ -72,8 +112,7 @@ async def check_availability(agent_id: str, date_str: str, asesor_calendar_id: s
 
 async def create_event_and_lock(agent_id: str, data: dict):
     tenant = TENANTS.get(agent_id)
-    service = get_service('calendar', 'v3', tenant['creds_file'])
-    
+
     # Usamos el ID específico
     calendar_id = get_target_calendar(tenant, data.get('asesor_calendar_id'))
 
@@ -86,28 +125,40 @@ async def create_event_and_lock(agent_id: str, data: dict):
     buffer_hours = tenant.get('appointment_buffer_hours', 2)
     end_dt = start_dt + timedelta(hours=buffer_hours)
 
-    # 1. VERIFICAR CONFLICTO EN CALENDARIO ESPECÍFICO
-    events_check = service.events().list(
-        calendarId=calendar_id,
-        timeMin=start_dt.isoformat(),
-        timeMax=end_dt.isoformat(),
-        singleEvents=True
-    ).execute()
-
-    if events_check.get('items'):
-        return False 
-
-    # 2. CREAR EVENTO
-    event = {
-        'summary': f"CITA: {data['cliente_nombre']} - {data.get('propiedad_interes', 'General')}",
-        'description': f"Cliente: {data['cliente_nombre']}\nTel: {data['cliente_telefono']}\nAsesor: {data.get('asesor_nombre')}",
-        'start': {'dateTime': start_dt.isoformat(), 'timeZone': 'America/Bogota'},
-        'end': {'dateTime': end_dt.isoformat(), 'timeZone': 'America/Bogota'},
-    }
-    
-    try:
-        service.events().insert(calendarId=calendar_id, body=event).execute()
-        return True
-    except Exception as e:
-        print(f"Error Calendar Insert: {e}")
-        return False
\ No newline at end of file
+    lock = _booking_locks.setdefault(calendar_id, asyncio.Lock())
+    async with lock:
+        # 1. VERIFICAR CONFLICTO EN CALENDARIO ESPECÍFICO
+        events_check = await google_batch.execute(
+            tenant['creds_file'], 'calendar', 'v3',
+            lambda svc: svc.events().list(
+                calendarId=calendar_id,
+                timeMin=start_dt.isoformat(),
+                timeMax=end_dt.isoformat(),
+                singleEvents=True
+            )
+        )
+
+        if events_check.get('items'):
+            return False 
+
+        # 2. CREAR EVENTO
+        event = {
+            'summary': f"CITA: {data['cliente_nombre']} - {data.get('propiedad_interes', 'General')}",
+            'description': f"Cliente: {data['cliente_nombre']}\nTel: {data['cliente_telefono']}\nAsesor: {data.get('asesor_nombre')}",
+            'start': {'dateTime': start_dt.isoformat(), 'timeZone': 'America/Bogota'},
+            'end': {'dateTime': end_dt.isoformat(), 'timeZone': 'America/Bogota'},
+        }
+        
+        try:
+            await google_batch.execute(
+                tenant['creds_file'], 'calendar', 'v3',
+                lambda svc: svc.events().insert(calendarId=calendar_id, body=event)
+            )
+        except Exception as e:
+            print(f"Error Calendar Insert: {e}")
+            return False
+
+    # Refrescar el índice y la caché sin esperar el push de Google
+    await availability_index.availability_cache.invalidate(f"{calendar_id}:{start_dt.date().isoformat()}")
+    availability_index.schedule_sync(calendar_id)
+    return True
@@ -0,0 +1,382 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+import pytz
+from app.core.redis_client import redis_client
+from app.services.notifications import send_whatsapp, format_fecha
+from app.config import (
+    GLOBAL_WA_TOKEN,
+    GLOBAL_WA_PHONE_ID,
+    WA_MESSAGES_PER_SECOND,
+    WA_BULK_CONCURRENCY,
+    WA_REMINDER_TEMPLATE,
+    REMINDER_OFFSETS_HOURS,
+)
+
+BOGOTA_TZ = pytz.timezone('America/Bogota')
+
+CAMPAIGN_TTL_SECONDS = 30 * 24 * 3600
+REMINDER_POLL_SECONDS = 30
+MAX_RETRIES = 3
+# Tiempo que un worker tiene reservado un destinatario (cubre los reintentos con backoff)
+CLAIM_LEASE_SECONDS = 600
+REMINDERS_KEY = "wa:reminders"
+REMINDERS_PROCESSING_KEY = "wa:reminders:processing"
+CAMPAIGN_JOBS_KEY = "campaign:jobs"
+CAMPAIGN_JOBS_PROCESSING_KEY = "campaign:jobs:processing"
+# Un envío en proceso por más tiempo que el reclamo se da por abandonado
+STALE_PROCESSING_SECONDS = CLAIM_LEASE_SECONDS + REMINDER_POLL_SECONDS
+# Errores de Meta por límite de throughput (se reintentan con backoff)
+RATE_LIMIT_CODES = {4, 80007, 130429, 131056}
+
+# Estructura en Redis:
+#   campaign:{id}:meta      hash  template, total, sent, failed, status
+#   campaign:{id}:results   hash  id del destinatario -> json con el resultado (checkpoint)
+#   campaign:{id}:claim:{item}  str  reclamo del destinatario por un worker (SET NX EX)
+#   wa:reminders            zset  json del recordatorio -> timestamp de envío
+#   wa:reminders:processing zset  recordatorios reclamados aún sin resultado -> timestamp del reclamo
+#   campaign:jobs           zset  json {campaign_id, template, recipients} -> timestamp de envío
+#   campaign:jobs:processing zset  campañas reclamadas sin terminar -> timestamp del reclamo
+
+_background_tasks = set()
+
+
+class RateLimiter:
+    """
+    Espacia los envíos para no superar `rate` mensajes por segundo
+    (compartido por todos los workers de la campaña).
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Un solo limitador por proceso: el límite de Meta es por número emisor
+_limiter = RateLimiter(WA_MESSAGES_PER_SECOND)
+
+
+async def _send_with_retry(recipient: dict, template: str, token: str, phone_id: str):
+    result = None
+    for attempt in range(MAX_RETRIES):
+        await _limiter.wait()
+        result = await send_whatsapp(
+            to=recipient["to"],
+            template=template,
+            params=recipient.get("params", []),
+            token=token,
+            phone_id=phone_id,
+        )
+        if result["ok"] or (result.get("status") != 429 and result.get("code") not in RATE_LIMIT_CODES):
+            break
+        await asyncio.sleep(2 ** attempt)
+    return result
+
+
+def _item_id(recipient: dict):
+    # Un mismo número puede recibir varios mensajes en una campaña (ej. recordatorios)
+    return recipient.get("id") or recipient["to"]
+
+
+async def send_campaign(campaign_id: str, template: str, recipients: list, on_result=None):
+    """
+    Envía una plantilla a muchos destinatarios respetando el throughput de Meta.
+
+    `recipients`: [{"to": "57300...", "params": ["Juan", ...], "id": opcional}, ...]
+    Cada destinatario se identifica por `id` (o por `to` si no trae). Antes de enviar
+    se reclama en Redis con SET NX: si otra ejecución de la misma campaña ya lo tiene
+    o ya lo envió, se salta. Así, volver a llamarla con el mismo `campaign_id`
+    (o correrla dos veces a la vez) no duplica mensajes.
+    `on_result(recipient, result)` se llama cuando el resultado ya quedó guardado.
+    Devuelve un resumen con el resultado por id.
+    """
+    token = os.getenv("WHATSAPP_TOKEN", GLOBAL_WA_TOKEN)
+    phone_id = os.getenv("WHATSAPP_PHONE_ID", GLOBAL_WA_PHONE_ID)
+    if not token or not phone_id:
+        print("⚠️ Token o Phone ID de WhatsApp no configurado; campaña no enviada.")
+        return {"campaign_id": campaign_id, "status": "not_configured"}
+
+    meta_key = f"campaign:{campaign_id}:meta"
+    results_key = f"campaign:{campaign_id}:results"
+    item_ids = [_item_id(r) for r in recipients]
+    if not recipients:
+        return {"campaign_id": campaign_id, "status": "done", "total": 0, "sent": 0, "failed": 0, "results": {}}
+
+    # 1. Checkpoint: quiénes ya fueron procesados en una ejecución anterior
+    done = await redis_client.hmget(results_key, item_ids)
+    pending = []
+    for recipient, previous in zip(recipients, done):
+        if previous is None:
+            pending.append(recipient)
+        elif on_result:
+            await on_result(recipient, json.loads(previous))
+
+    pipe = redis_client.pipeline()
+    pipe.hset(meta_key, mapping={"template": template, "total": len(recipients), "status": "running"})
+    pipe.expire(meta_key, CAMPAIGN_TTL_SECONDS)
+    await pipe.execute()
+    print(f"📣 Campaña {campaign_id}: {len(pending)} pendientes de {len(recipients)}")
+
+    # 2. Pool de workers con concurrencia limitada
+    queue = asyncio.Queue()
+    for recipient in pending:
+        queue.put_nowait(recipient)
+
+    async def worker():
+        while not queue.empty():
+            recipient = queue.get_nowait()
+            item_id = _item_id(recipient)
+
+            # Reclamo atómico: solo una ejecución envía cada destinatario.
+            # El reclamo expira por si el proceso muere a mitad del envío.
+            claimed = await redis_client.set(
+                f"campaign:{campaign_id}:claim:{item_id}", "1", nx=True, ex=CLAIM_LEASE_SECONDS
+            )
+            if not claimed or await redis_client.hexists(results_key, item_id):
+                continue
+
+            result = await _send_with_retry(recipient, template, token, phone_id)
+            result = {"to": recipient["to"], **result}
+
+            pipe = redis_client.pipeline()
+            pipe.hset(results_key, item_id, json.dumps(result))
+            pipe.hincrby(meta_key, "sent" if result["ok"] else "failed", 1)
+            pipe.expire(results_key, CAMPAIGN_TTL_SECONDS)
+            await pipe.execute()
+
+            if on_result:
+                await on_result(recipient, result)
+
+    await asyncio.gather(*(worker() for _ in range(min(WA_BULK_CONCURRENCY, len(pending)))))
+
+    # 3. Reporte desde Redis: incluye lo enviado en ejecuciones anteriores o concurrentes
+    raws = await redis_client.hmget(results_key, item_ids)
+    report = {item_id: json.loads(raw) for item_id, raw in zip(item_ids, raws) if raw is not None}
+    sent = sum(1 for r in report.values() if r["ok"])
+    in_progress = len(set(item_ids)) - len(report)
+    status = "done" if not in_progress else "running"
+    await redis_client.hset(meta_key, "status", status)
+
+    print(f"✅ Campaña {campaign_id}: {sent} enviados, {len(report) - sent} fallidos"
+          + (f", {in_progress} en curso en otro worker" if in_progress else ""))
+    return {
+        "campaign_id": campaign_id,
+        "status": status,
+        "total": len(recipients),
+        "sent": sent,
+        "failed": len(report) - sent,
+        "in_progress": in_progress,
+        "results": report,
+    }
+
+
+# --- COLAS DURABLES (zset pendiente + zset en proceso) ---
+
+async def _claim_due(queue_key: str, processing_key: str, now: float, limit: int = 1000):
+    """
+    Reclama los miembros vencidos de `queue_key` moviéndolos a `processing_key`.
+    Ambos comandos van en la misma transacción: ZREM devuelve 1 solo al worker
+    que lo reclamó primero (seguro con varios procesos) y nada se pierde si el
+    proceso muere antes de terminar.
+    """
+    due = await redis_client.zrangebyscore(queue_key, 0, now, start=0, num=limit)
+    if not due:
+        return []
+
+    pipe = redis_client.pipeline()
+    for member in due:
+        pipe.zadd(processing_key, {member: now})
+        pipe.zrem(queue_key, member)
+    removed = (await pipe.execute())[1::2]
+    return [m for m, ok in zip(due, removed) if ok]
+
+
+async def _requeue(queue_key: str, processing_key: str, older_than: float = None):
+    """Devuelve a `queue_key` lo que lleva en proceso más de `older_than` segundos (o todo)."""
+    now = time.time()
+    max_score = now - older_than if older_than is not None else "+inf"
+    members = await redis_client.zrangebyscore(processing_key, "-inf", max_score)
+    if not members:
+        return 0
+    pipe = redis_client.pipeline()
+    pipe.zadd(queue_key, {m: now for m in members})
+    pipe.zrem(processing_key, *members)
+    await pipe.execute()
+    return len(members)
+
+
+# --- CAMPAÑAS EN SEGUNDO PLANO ---
+
+async def launch_campaign(campaign_id: str, template: str, recipients: list):
+    """
+    Guarda la campaña como job en Redis y la despacha en segundo plano.
+    Al volver, el job ya es durable: si el proceso muere antes de terminar,
+    el loop de campañas la retoma (el checkpoint evita reenvíos).
+    """
+    job = json.dumps({"campaign_id": campaign_id, "template": template, "recipients": recipients},
+                     sort_keys=True, ensure_ascii=False, default=str)
+    await redis_client.zadd(CAMPAIGN_JOBS_KEY, {job: time.time()})
+
+    task = asyncio.create_task(dispatch_campaign_jobs())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def requeue_campaign_jobs(older_than: float = None):
+    count = await _requeue(CAMPAIGN_JOBS_KEY, CAMPAIGN_JOBS_PROCESSING_KEY, older_than)
+    if count:
+        print(f"📣 {count} campañas en proceso devueltas a la cola")
+
+
+async def dispatch_campaign_jobs():
+    try:
+        claimed = await _claim_due(CAMPAIGN_JOBS_KEY, CAMPAIGN_JOBS_PROCESSING_KEY, time.time())
+        for member in claimed:
+            job = json.loads(member)
+            report = await send_campaign(job["campaign_id"], job["template"], job["recipients"])
+            # Si otro worker tiene destinatarios reclamados sin resultado, el job se
+            # queda en proceso y vuelve a la cola cuando esos reclamos expiren
+            if report["status"] == "done":
+                await redis_client.zrem(CAMPAIGN_JOBS_PROCESSING_KEY, member)
+    except Exception as e:
+        print(f"❌ Error despachando campañas: {e}")
+
+
+# --- RECORDATORIOS DE CITAS ---
+
+async def schedule_booking_reminders(agent_id: str, data: dict):
+    """
+    Programa los recordatorios (24h y 1h antes) de una cita recién agendada.
+    """
+    try:
+        dt_naive = datetime.fromisoformat(data["fecha_hora_inicio"])
+        start_dt = BOGOTA_TZ.localize(dt_naive) if dt_naive.tzinfo is None else dt_naive
+    except (KeyError, ValueError):
+        return
+
+    params = [
+        data.get("cliente_nombre", "Cliente"),
+        format_fecha(data["fecha_hora_inicio"]),
+        data.get("asesor_nombre", "Asesor"),
+        data.get("propiedad_interes", "Propiedad"),
+    ]
+    now = time.time()
+    reminders = {}
+    for hours in REMINDER_OFFSETS_HOURS:
+        send_at = (start_dt - timedelta(hours=hours)).timestamp()
+        # Si la cita es muy pronto, ese recordatorio ya no aplica
+        if send_at <= now:
+            continue
+        reminder = {
+            "agent_id": agent_id,
+            "to": data["cliente_telefono"],
+            "params": params,
+            "offset_hours": hours,
+            "cita": data["fecha_hora_inicio"],
+        }
+        reminders[json.dumps(reminder, sort_keys=True)] = send_at
+
+    if reminders:
+        await redis_client.zadd(REMINDERS_KEY, reminders)
+        print(f"⏰ {len(reminders)} recordatorios programados para {data['cliente_telefono']}")
+
+
+def _reminder_id(reminder: dict):
+    return f"{reminder.get('agent_id')}:{reminder['to']}:{reminder['cita']}:{reminder['offset_hours']}h"
+
+
+def _cita_passed(reminder: dict, now: float):
+    try:
+        dt_naive = datetime.fromisoformat(reminder["cita"])
+    except (KeyError, ValueError):
+        return True
+    start_dt = BOGOTA_TZ.localize(dt_naive) if dt_naive.tzinfo is None else dt_naive
+    return start_dt.timestamp() <= now
+
+
+async def requeue_reminders(older_than: float = None):
+    """
+    Devuelve a la cola los recordatorios que quedaron en proceso (ej. el proceso
+    murió a mitad del envío). El checkpoint de la campaña evita reenviar los que
+    alcanzaron a salir.
+    Sin `older_than` devuelve todos (arranque); con él, solo los reclamados hace
+    más de esos segundos.
+    """
+    count = await _requeue(REMINDERS_KEY, REMINDERS_PROCESSING_KEY, older_than)
+    if count:
+        print(f"⏰ {count} recordatorios en proceso devueltos a la cola")
+
+
+async def dispatch_due_reminders():
+    now = time.time()
+    claimed = await _claim_due(REMINDERS_KEY, REMINDERS_PROCESSING_KEY, now)
+    if not claimed:
+        return
+
+    recipients = []
+    members_by_id = {}
+    expired = []
+    for member in claimed:
+        reminder = json.loads(member)
+        # Si la cita ya pasó (ej. el servicio estuvo caído), el recordatorio no sirve
+        if _cita_passed(reminder, now):
+            expired.append(member)
+            continue
+        reminder["id"] = _reminder_id(reminder)
+        members_by_id[reminder["id"]] = member
+        recipients.append(reminder)
+
+    if expired:
+        await redis_client.zrem(REMINDERS_PROCESSING_KEY, *expired)
+        print(f"⏰ {len(expired)} recordatorios descartados: la cita ya pasó")
+    if not recipients:
+        return
+
+    async def on_result(recipient, result):
+        await redis_client.zrem(REMINDERS_PROCESSING_KEY, members_by_id[recipient["id"]])
+
+    # Una campaña por día de cita: el checkpoint de cada día expira solo
+    by_day = {}
+    for reminder in recipients:
+        by_day.setdefault(reminder["cita"][:10], []).append(reminder)
+    for day, batch in by_day.items():
+        await send_campaign(f"recordatorios:{day}", WA_REMINDER_TEMPLATE, batch, on_result=on_result)
+
+
+async def _dispatch_loop():
+    try:
+        await requeue_reminders()
+        await requeue_campaign_jobs()
+    except Exception as e:
+        print(f"❌ Error recuperando envíos en proceso: {e}")
+
+    while True:
+        try:
+            # Si al reintentar el reclamo de la campaña seguía tomado (ej. el proceso
+            # anterior murió a mitad del envío), el envío queda en proceso:
+            # vuelve a la cola cuando ese reclamo ya expiró
+            await requeue_reminders(older_than=STALE_PROCESSING_SECONDS)
+            await requeue_campaign_jobs(older_than=STALE_PROCESSING_SECONDS)
+            await dispatch_due_reminders()
+        except Exception as e:
+            print(f"❌ Error enviando recordatorios: {e}")
+        await dispatch_campaign_jobs()
+        await asyncio.sleep(REMINDER_POLL_SECONDS)
+
+
+def start():
+    """Arranca el despachador de recordatorios y campañas (llamar en el startup de la app)."""
+    task = asyncio.create_task(_dispatch_loop())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import time
+import zlib
+from app.core.redis_client import redis_client
+from app.config import (
+    WA_INBOUND_WORKERS,
+    WA_CONVERSATION_HISTORY,
+    WA_CONVERSATION_TTL_SECONDS,
+    DEFAULT_COUNTRY_CODE,
+)
+
+# Vínculo teléfono -> cita/lead creado por el agente de voz
+LEAD_LINK_TTL_SECONDS = 30 * 24 * 3600
+MAX_TEXT_LENGTH = 500
+
+# Estructura en Redis (por remitente):
+#   wa:conv:{phone}          hash  estado compacto (nombre, último mensaje, contador, lead)
+#   wa:conv:{phone}:history  list  últimos N mensajes (json compacto, el más nuevo primero)
+#   wa:link:{phone}          hash  cita/lead del agente de voz
+#   wa:msg:{wamid}           str   marca de mensaje ya procesado (Meta reenvía webhooks)
+#   wa:inbox:{shard}         list  mensajes recibidos pendientes de procesar (FIFO)
+#   wa:inbox:{shard}:processing list  mensaje que el worker del shard está procesando
+#   wa:inbox:dead            list  mensajes que fallaron MAX_ATTEMPTS veces
+
+# Nota: cambiar WA_INBOUND_WORKERS entre despliegues deja mensajes en shards que ya no existen
+INBOX_POLL_SECONDS = 1  # menor que REDIS_SOCKET_TIMEOUT
+MAX_ATTEMPTS = 3
+
+_workers = set()
+
+
+def normalize_phone(phone):
+    """
+    Deja solo dígitos y agrega el indicativo si viene un celular local de 10 dígitos,
+    así '+57 300 123 4567', '3001234567' y '573001234567' son la misma llave.
+    """
+    digits = "".join(c for c in str(phone or "") if c.isdigit())
+    if len(digits) == 10:
+        digits = DEFAULT_COUNTRY_CODE + digits
+    return digits
+
+
+def _message_text(message):
+    msg_type = message.get("type")
+    if msg_type == "text":
+        return message.get("text", {}).get("body", "")
+    if msg_type == "button":
+        return message.get("button", {}).get("text", "")
+    if msg_type == "interactive":
+        interactive = message.get("interactive", {})
+        reply = interactive.get("button_reply") or interactive.get("list_reply") or {}
+        return reply.get("title", "")
+    # Audio, imagen, ubicación, etc.: solo registramos el tipo
+    return f"[{msg_type}]"
+
+
+# --- VÍNCULO CON EL AGENTE DE VOZ ---
+
+async def link_voice_lead(agent_id: str, data: dict):
+    """
+    Guarda la cita/lead creada por teléfono para asociarla a los WhatsApp de ese número.
+    """
+    phone = normalize_phone(data.get("cliente_telefono"))
+    if not phone:
+        return
+
+    link = {
+        "agent_id": agent_id,
+        "cliente_nombre": data.get("cliente_nombre", ""),
+        "propiedad_interes": data.get("propiedad_interes", ""),
+        "asesor_nombre": data.get("asesor_nombre", ""),
+        "fecha_hora_inicio": data.get("fecha_hora_inicio", ""),
+        "estado": "Agendado" if data.get("fecha_hora_inicio") else "Interesado",
+        "updated_at": str(int(time.time())),
+    }
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(f"wa:link:{phone}", mapping=link)
+        pipe.expire(f"wa:link:{phone}", LEAD_LINK_TTL_SECONDS)
+        await pipe.execute()
+    except Exception as e:
+        print(f"❌ Error vinculando lead {phone}: {e}")
+
+
+# --- PROCESAMIENTO ORDENADO POR REMITENTE ---
+
+def contact_names(contacts: list):
+    """Nombre de perfil por wa_id (un webhook puede traer varios remitentes)."""
+    return {c.get("wa_id"): c.get("profile", {}).get("name") for c in contacts if c.get("wa_id")}
+
+
+async def process_message(message: dict, contact_name: str = None):
+    sender = normalize_phone(message.get("from"))
+    msg_id = message.get("id", "")
+    msg_type = message.get("type")
+    text = _message_text(message)[:MAX_TEXT_LENGTH]
+
+    # Meta puede reenviar el mismo webhook; solo procesamos cada wamid una vez
+    marker_key = f"wa:msg:{msg_id}"
+    if msg_id and await redis_client.exists(marker_key):
+        print(f"♻️ Mensaje duplicado ignorado: {msg_id}")
+        return
+
+    conv_key = f"wa:conv:{sender}"
+    history_key = f"{conv_key}:history"
+    link = await redis_client.hgetall(f"wa:link:{sender}")
+
+    entry = {"id": msg_id, "t": msg_type, "ts": message.get("timestamp"), "txt": text}
+    state = {
+        "last_message_id": msg_id,
+        "last_message_at": message.get("timestamp") or str(int(time.time())),
+        "last_text": text,
+    }
+    if contact_name:
+        state["nombre"] = contact_name
+    if link:
+        # Referencia compacta a la cita/lead del agente de voz
+        state["agent_id"] = link.get("agent_id", "")
+        state["lead_estado"] = link.get("estado", "")
+        state["lead_fecha"] = link.get("fecha_hora_inicio", "")
+        state["lead_propiedad"] = link.get("propiedad_interes", "")
+
+    # Estado, historial y marca de procesado en una sola transacción:
+    # si algo falla, no queda marcado y el worker lo reintenta
+    pipe = redis_client.pipeline()
+    pipe.hset(conv_key, mapping=state)
+    pipe.hincrby(conv_key, "message_count", 1)
+    pipe.lpush(history_key, json.dumps(entry, ensure_ascii=False))
+    pipe.ltrim(history_key, 0, WA_CONVERSATION_HISTORY - 1)
+    pipe.expire(conv_key, WA_CONVERSATION_TTL_SECONDS)
+    pipe.expire(history_key, WA_CONVERSATION_TTL_SECONDS)
+    if msg_id:
+        pipe.set(marker_key, "1", ex=86400)
+    await pipe.execute()
+
+    lead_info = f" | Lead: {link.get('estado')} {link.get('fecha_hora_inicio', '')}" if link else ""
+    print(f"💬 Conversación {sender}: {text}{lead_info}")
+
+
+def _shard(phone: str):
+    return zlib.crc32(normalize_phone(phone).encode()) % WA_INBOUND_WORKERS
+
+
+async def receive(message: dict, contact_name: str = None):
+    """
+    Guarda el mensaje en la cola de su shard en Redis ANTES de responderle a Meta,
+    así un reinicio no pierde mensajes. El shard sale de un hash estable del número:
+    los mensajes de un remitente quedan en orden y remitentes distintos van en paralelo.
+    """
+    item = {"message": message, "nombre": contact_name, "intentos": 0}
+    await redis_client.rpush(f"wa:inbox:{_shard(message.get('from'))}", json.dumps(item, ensure_ascii=False))
+
+
+async def _requeue_in_flight(inbox: str, processing: str):
+    # Lo que quedó a medias antes de un reinicio vuelve al frente de la cola, en orden
+    while await redis_client.lmove(processing, inbox, "RIGHT", "LEFT"):
+        pass
+
+
+async def _worker(shard: int):
+    inbox = f"wa:inbox:{shard}"
+    processing = f"{inbox}:processing"
+    requeued = False
+
+    while True:
+        try:
+            if not requeued:
+                await _requeue_in_flight(inbox, processing)
+                requeued = True
+
+            raw = await redis_client.blmove(inbox, processing, INBOX_POLL_SECONDS, "LEFT", "RIGHT")
+            if raw is None:
+                continue
+
+            item = json.loads(raw)
+            try:
+                await process_message(item["message"], item.get("nombre"))
+            except Exception as e:
+                item["intentos"] = item.get("intentos", 0) + 1
+                sender = item["message"].get("from")
+                if item["intentos"] < MAX_ATTEMPTS:
+                    print(f"⚠️ Error procesando mensaje de {sender} (intento {item['intentos']}): {e}")
+                    await asyncio.sleep(1)
+                    # Al frente de la cola para no adelantar mensajes posteriores del remitente
+                    await redis_client.lpush(inbox, json.dumps(item, ensure_ascii=False))
+                else:
+                    print(f"❌ Mensaje de {sender} descartado tras {MAX_ATTEMPTS} intentos: {e}")
+                    await redis_client.rpush("wa:inbox:dead", json.dumps(item, ensure_ascii=False))
+
+            await redis_client.lrem(processing, 1, raw)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Error en worker de WhatsApp {shard}: {e}")
+            await asyncio.sleep(1)
+
+
+def start():
+    """Arranca el pool de workers, uno por shard (llamar en el startup de la app)."""
+    if _workers:
+        return
+    for shard in range(WA_INBOUND_WORKERS):
+        task = asyncio.create_task(_worker(shard))
+        _workers.add(task)
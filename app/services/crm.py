@@ -1,6 +1,6 @@
 from datetime import datetime
 import pytz
-from app.core.google_auth import get_service
+from app.core import google_batch
 from app.config import TENANTS
 
 BOGOTA_TZ = pytz.timezone('America/Bogota')
@@ -11,8 +11,6 @@ async def log_lead_bg(agent_id: str, data: dict):
     if not tenant: return
 
     try:
-        service = get_service('sheets', 'v4', tenant['creds_file'])
-        
         now_bogota = datetime.now(BOGOTA_TZ)
         fecha = now_bogota.strftime("%Y-%m-%d")
         hora = now_bogota.strftime("%I:%M %p")
@@ -35,13 +33,16 @@ async def log_lead_bg(agent_id: str, data: dict):
 
         body = {'values': [row_values]}
         
-        service.spreadsheets().values().append(
-            spreadsheetId=tenant['sheet_crm_id'],
-            range="Leads!A:H", # Rango ampliado
-            valueInputOption="USER_ENTERED",
-            insertDataOption="INSERT_ROWS",
-            body=body
-        ).execute()
+        await google_batch.execute(
+            tenant['creds_file'], 'sheets', 'v4',
+            lambda svc: svc.spreadsheets().values().append(
+                spreadsheetId=tenant['sheet_crm_id'],
+                range="Leads!A:H", # Rango ampliado
+                valueInputOption="USER_ENTERED",
+                insertDataOption="INSERT_ROWS",
+                body=body
+            )
+        )
         print(f"✅ Lead guardado con Asesor: {data.get('asesor_nombre')}")
         
     except Exception as e:
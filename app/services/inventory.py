@@ -1,35 +1,28 @@
 import json
+import asyncio
 import pandas as pd
-import io
-import unicodedata
-from app.core.redis_client import redis_client
-from app.core.google_auth import get_service
+from app.core.cache import TieredCache
+from app.core.text import normalize_text
+from app.core import google_batch
+from app.services import saved_searches
 from app.config import TENANTS
 
-# --- FUNCIÓN HELPER PARA NORMALIZAR TEXTO (Tildes y Mayúsculas) ---
-def normalize_text(text):
-    
-    if not isinstance(text, str):
-        return str(text)
-    
-    # 1. Normalizar unicode (separar caracteres de sus tildes)
-    normalized = unicodedata.normalize('NFD', text)
-    # 2. Filtrar solo caracteres no-diacríticos y pasar a minúsculas
-    return "".join(c for c in normalized if unicodedata.category(c) != 'Mn').lower()
+_background_tasks = set()
+
+# Inventario por agente: 5 min en Redis, 1 min en memoria de cada worker
+inventory_cache = TieredCache("inventory", ttl=300, l1_ttl=60)
 
 async def search_inventory(agent_id: str, args: dict):
     tenant = TENANTS.get(agent_id)
     if not tenant: return "Error: Agente no configurado."
 
-    cache_key = f"inventory:{agent_id}"
-    
-    # --- FASE 1: LEER DATOS (Redis o Sheets) ---
-    cached_json = await redis_client.get(cache_key)
+    # --- FASE 1: LEER DATOS (Caché L1/Redis o Sheets) ---
+    cached_records = await inventory_cache.get(agent_id)
     df = None
 
-    if cached_json:
+    if cached_records:
         try:
-            df = pd.read_json(io.StringIO(cached_json), orient='records')
+            df = pd.DataFrame(cached_records)
             if 'precio_total_cop' not in df.columns and 'canon_mensual_cop' not in df.columns:
                 df = None 
         except Exception:
@@ -38,11 +31,13 @@ async def search_inventory(agent_id: str, args: dict):
     if df is None:
         try:
             # Descarga de Google Sheets
-            service = get_service('sheets', 'v4', tenant['creds_file'])
-            result = service.spreadsheets().values().get(
-                spreadsheetId=tenant['sheet_inventory_id'], 
-                range=tenant['inventory_range']
-            ).execute()
+            result = await google_batch.execute(
+                tenant['creds_file'], 'sheets', 'v4',
+                lambda svc: svc.spreadsheets().values().get(
+                    spreadsheetId=tenant['sheet_inventory_id'], 
+                    range=tenant['inventory_range']
+                )
+            )
             
             rows = result.get('values', [])
             if not rows: return "El inventario está vacío."
@@ -82,7 +77,14 @@ async def search_inventory(agent_id: str, args: dict):
             if 'canon_mensual_cop' in df.columns: df['canon_mensual_cop'] = df['canon_mensual_cop'].apply(clean_money)
             if 'valor_administracion_mensual_cop' in df.columns: df['valor_administracion_mensual_cop'] = df['valor_administracion_mensual_cop'].apply(clean_money).fillna(0)
 
-            await redis_client.setex(cache_key, 300, df.to_json(orient='records'))
+            # Registros JSON-safe (NaN -> None) para la caché y las búsquedas guardadas
+            records = json.loads(df.to_json(orient='records'))
+            await inventory_cache.set(agent_id, records)
+
+            # Avisar a los leads con búsquedas guardadas que coincidan (en segundo plano)
+            task = asyncio.create_task(saved_searches.on_inventory_refresh(agent_id, records))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
 
         except Exception as e:
             print(f"❌ Error Sheets: {e}")
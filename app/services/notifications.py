@@ -17,6 +17,32 @@ except:
     pass
 
 
+# Cliente HTTP compartido: reutiliza conexiones TLS con Graph API entre envíos
+_http_client = None
+
+
+def get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(15.0, connect=5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        )
+    return _http_client
+
+
+def format_fecha(fecha_raw: str):
+    """'2025-01-20T15:00:00' -> '20/01/2025 a las 03:00 PM'"""
+    fecha_humana = fecha_raw
+    try:
+        if "T" in fecha_raw:
+            dt = datetime.fromisoformat(fecha_raw)
+            fecha_humana = dt.strftime("%d/%m/%Y a las %I:%M %p")
+    except:
+        pass
+    return fecha_humana
+
+
 async def notify_all_parties(agent_id: str, data: dict):
     """
     Orquesta el envío de WhatsApps y Correos Electrónicos.
@@ -38,14 +64,7 @@ async def notify_all_parties(agent_id: str, data: dict):
     )  # Asumimos que el ID del calendario es el email
 
     # Formateo de fecha
-    fecha_raw = data.get("fecha_hora_inicio", "")
-    fecha_humana = fecha_raw
-    try:
-        if "T" in fecha_raw:
-            dt = datetime.fromisoformat(fecha_raw)
-            fecha_humana = dt.strftime("%d/%m/%Y a las %I:%M %p")
-    except:
-        pass
+    fecha_humana = format_fecha(data.get("fecha_hora_inicio", ""))
 
     propiedad = data.get("propiedad_interes", "Propiedad")
     cliente_nombre = data.get("cliente_nombre", "Cliente")
@@ -138,11 +157,25 @@ async def send_whatsapp(
             ],
         },
     }
-    async with httpx.AsyncClient() as client:
-        try:
-            await client.post(url, json=payload, headers=headers)
-        except Exception as e:
-            print(f"❌ Error WhatsApp: {e}")
+    try:
+        response = await get_http_client().post(url, json=payload, headers=headers)
+        body = response.json()
+    except Exception as e:
+        print(f"❌ Error WhatsApp: {e}")
+        return {"ok": False, "status": None, "error": str(e)}
+
+    # Respuesta de Graph API: {"messages": [{"id": "wamid..."}]} o {"error": {...}}
+    if response.status_code == 200:
+        return {"ok": True, "status": 200, "id": body.get("messages", [{}])[0].get("id")}
+
+    error = body.get("error", {})
+    print(f"❌ Error WhatsApp {response.status_code}: {error.get('message')}")
+    return {
+        "ok": False,
+        "status": response.status_code,
+        "code": error.get("code"),
+        "error": error.get("message"),
+    }
 
 
 def send_email_smtp(to_email, subject, body_html):
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import math
+import time
+import uuid
+from app.core.redis_client import redis_client
+from app.core.text import normalize_text
+from app.services import campaigns
+from app.services.conversations import normalize_phone
+from app.config import LISTING_ALERT_TEMPLATE
+
+# Estructura en Redis (por tenant):
+#   ss:{agent}:search:{phone}        hash  criterios de la última búsqueda del lead
+#   ss:{agent}:idx:{op}:{ciudad}     zset  phone -> presupuesto_max (+inf si no dio presupuesto)
+#   ss:{agent}:cities:{op}           set   ciudades con búsquedas guardadas ("*" = cualquiera)
+#   ss:{agent}:ops                   set   operaciones con búsquedas guardadas
+#   inventory:{agent}:fingerprints   hash  id de la propiedad -> hash de la fila
+#   inventory:{agent}:refresh_lock   str   un solo worker compara/alerta a la vez (SET NX EX)
+
+ANY_CITY = "*"
+LISTING_ID_COLUMNS = ['codigo', 'id', 'referencia', 'direccion']
+REFRESH_LOCK_SECONDS = 60
+
+
+def _normalize(text):
+    return normalize_text(text).strip()
+
+
+def _to_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def _caller_phone(args: dict):
+    # El teléfono puede venir como argumento o en el objeto 'call' de Retell
+    call = args.get("call") if isinstance(args.get("call"), dict) else {}
+    return normalize_phone(args.get("cliente_telefono") or call.get("from_number") or args.get("from_number"))
+
+
+# --- GUARDAR CRITERIOS ---
+
+async def save_search(agent_id: str, args: dict):
+    """
+    Guarda los criterios de search_inventory como búsqueda del número que llama.
+    Cada número tiene una sola búsqueda: la más reciente reemplaza a la anterior.
+    """
+    phone = _caller_phone(args)
+    if not phone:
+        # El payload plano de Retell no trae el número: sin él no hay a quién alertar
+        print(f"⚠️ Búsqueda no guardada para {agent_id}: la llamada no trae teléfono del cliente")
+        return
+
+    ciudad = _normalize(args['ciudad']) if args.get('ciudad') else ANY_CITY
+    operacion = _normalize(args.get('tipo_operacion', 'Venta'))
+    presupuesto = _to_number(args.get('presupuesto_max'))
+    search_key = f"ss:{agent_id}:search:{phone}"
+
+    try:
+        old = await redis_client.hgetall(search_key)
+
+        pipe = redis_client.pipeline()
+        # Sacar el número del índice anterior si cambió de ciudad u operación
+        if old and (old.get('ciudad') != ciudad or old.get('tipo_operacion') != operacion):
+            pipe.zrem(f"ss:{agent_id}:idx:{old['tipo_operacion']}:{old['ciudad']}", phone)
+
+        pipe.hset(search_key, mapping={
+            "ciudad": ciudad,
+            "zona": _normalize(args['zona_ciudad']) if args.get('zona_ciudad') else "",
+            "tipo_operacion": operacion,
+            "presupuesto_max": "" if presupuesto is None else str(presupuesto),
+            "cliente_nombre": args.get('cliente_nombre', ''),
+            "updated_at": str(int(time.time())),
+        })
+        pipe.zadd(f"ss:{agent_id}:idx:{operacion}:{ciudad}", {phone: presupuesto if presupuesto is not None else math.inf})
+        pipe.sadd(f"ss:{agent_id}:cities:{operacion}", ciudad)
+        pipe.sadd(f"ss:{agent_id}:ops", operacion)
+        await pipe.execute()
+    except Exception as e:
+        print(f"❌ Error guardando búsqueda de {phone}: {e}")
+
+
+# --- MATCHING CONTRA INVENTARIO NUEVO ---
+
+def _listing_key(row: dict, fingerprint: str):
+    for col in LISTING_ID_COLUMNS:
+        if row.get(col) not in (None, ""):
+            return f"{col}:{row[col]}"
+    return f"hash:{fingerprint}"
+
+
+def _listing_price(row: dict, operacion: str):
+    """Mismo criterio de precio que el filtro de search_inventory."""
+    if operacion == 'arriendo':
+        canon = _to_number(row.get('canon_mensual_cop'))
+        if canon is None:
+            return None
+        return canon + (_to_number(row.get('valor_admin_cop')) or 0)
+    return _to_number(row.get('precio_total_cop'))
+
+
+async def _changed_listings(agent_id: str, records: list):
+    """
+    Compara el inventario nuevo con las huellas del refresco anterior.
+    Devuelve (filas nuevas o modificadas, huellas nuevas). Las huellas NO se
+    guardan aquí: solo después de encolar las alertas, para que un fallo a mitad
+    de camino deje el cambio pendiente para el próximo refresco.
+    """
+    fingerprints = {}
+    rows_by_key = {}
+    for row in records:
+        fingerprint = hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode()).hexdigest()
+        key = _listing_key(row, fingerprint)
+        fingerprints[key] = fingerprint
+        rows_by_key[key] = row
+
+    previous = await redis_client.hgetall(f"inventory:{agent_id}:fingerprints")
+
+    # Primer refresco: solo tomamos la línea base para no alertar todo el inventario
+    if not previous:
+        return [], fingerprints
+
+    return [rows_by_key[k] for k, fp in fingerprints.items() if previous.get(k) != fp], fingerprints
+
+
+async def _save_fingerprints(agent_id: str, fingerprints: dict):
+    fp_key = f"inventory:{agent_id}:fingerprints"
+    pipe = redis_client.pipeline()
+    pipe.delete(fp_key)
+    if fingerprints:
+        pipe.hset(fp_key, mapping=fingerprints)
+    await pipe.execute()
+
+
+async def match_listings(agent_id: str, listings: list):
+    """
+    Encuentra las búsquedas guardadas que cumplen cada propiedad, usando solo
+    los índices de (operación, ciudad) afectados y el rango de presupuesto.
+    Devuelve {phone: {"cliente_nombre": ..., "listings": [propiedades]}}.
+    """
+    ops = await redis_client.smembers(f"ss:{agent_id}:ops")
+    if not ops:
+        return {}
+
+    cities_by_op = {}
+    for op in ops:
+        cities_by_op[op] = await redis_client.smembers(f"ss:{agent_id}:cities:{op}")
+
+    # 1. Una consulta por (propiedad, índice afectado), todas en un solo pipeline
+    queries = []
+    pipe = redis_client.pipeline(transaction=False)
+    for listing in listings:
+        listing_op = _normalize(listing.get('tipo_operacion', ''))
+        listing_city = _normalize(listing.get('ciudad', ''))
+        for op in ops:
+            if op not in listing_op:
+                continue
+            price = _listing_price(listing, op)
+            # Sin precio solo aplica a quien no dio presupuesto
+            min_budget = price if price is not None else math.inf
+            for city in cities_by_op[op]:
+                if city == ANY_CITY or city in listing_city:
+                    pipe.zrangebyscore(f"ss:{agent_id}:idx:{op}:{city}", min_budget, math.inf)
+                    queries.append(listing)
+    if not queries:
+        return {}
+
+    candidates = []
+    for listing, phones in zip(queries, await pipe.execute()):
+        candidates.extend((phone, listing) for phone in phones)
+    if not candidates:
+        return {}
+
+    # 2. Filtro de zona (el único criterio que no está en el índice)
+    pipe = redis_client.pipeline(transaction=False)
+    for phone, _ in candidates:
+        pipe.hmget(f"ss:{agent_id}:search:{phone}", "zona", "cliente_nombre")
+    searches = await pipe.execute()
+
+    matches = {}
+    for (phone, listing), (zona, nombre) in zip(candidates, searches):
+        if zona and zona not in _normalize(listing.get('zona_ciudad', '')):
+            continue
+        entry = matches.setdefault(phone, {"cliente_nombre": nombre, "listings": []})
+        # Comparación por identidad: las filas pueden traer NaN (NaN != NaN)
+        if all(l is not listing for l in entry["listings"]):
+            entry["listings"].append(listing)
+    return matches
+
+
+def _describe(listing: dict):
+    partes = [listing.get('barrio') or listing.get('zona_ciudad'), listing.get('ciudad')]
+    return ", ".join(str(p) for p in partes if p) or "nueva propiedad"
+
+
+def _format_price(listing: dict):
+    operacion = _normalize(listing.get('tipo_operacion', ''))
+    price = _listing_price(listing, 'arriendo' if 'arriendo' in operacion else 'venta')
+    return f"$ {int(price):,.0f} COP".replace(",", ".") if price is not None else "Consultar"
+
+
+async def _enqueue_alerts(agent_id: str, changed: list):
+    """Encuentra los leads que coinciden y deja la campaña de alertas como job en Redis."""
+    matches = await match_listings(agent_id, changed)
+    print(f"🔎 {len(changed)} propiedades nuevas/modificadas -> {len(matches)} leads coinciden")
+    if not matches:
+        return
+
+    recipients = []
+    for phone, match in matches.items():
+        first = match["listings"][0]
+        descripcion = _describe(first)
+        if len(match["listings"]) > 1:
+            descripcion += f" (+{len(match['listings']) - 1} más)"
+        recipients.append({
+            "to": phone,
+            "params": [match["cliente_nombre"] or "Hola", descripcion, _format_price(first)],
+        })
+
+    # Id determinístico: si el mismo cambio se procesa dos veces, los reclamos de la campaña evitan duplicados
+    change_id = hashlib.sha1(json.dumps(changed, sort_keys=True, default=str).encode()).hexdigest()[:12]
+    await campaigns.launch_campaign(f"nuevas:{agent_id}:{change_id}", LISTING_ALERT_TEMPLATE, recipients)
+
+
+async def on_inventory_refresh(agent_id: str, records: list):
+    """
+    Llamado cada vez que el inventario se descarga de Sheets.
+    Evalúa solo las propiedades nuevas/modificadas y encola las alertas
+    (campaigns las envía desde Redis, así que sobreviven a un reinicio).
+    Si otro worker está procesando un refresco del mismo tenant, este se omite:
+    leer y reemplazar las huellas a la vez haría que ambos alertaran el mismo cambio.
+    """
+    lock_key = f"inventory:{agent_id}:refresh_lock"
+    lock_token = uuid.uuid4().hex
+    try:
+        if not await redis_client.set(lock_key, lock_token, nx=True, ex=REFRESH_LOCK_SECONDS):
+            print(f"🔒 Refresco de inventario de {agent_id} ya en proceso en otro worker")
+            return
+    except Exception as e:
+        print(f"❌ Error evaluando búsquedas guardadas: {e}")
+        return
+
+    try:
+        changed, fingerprints = await _changed_listings(agent_id, records)
+        if changed:
+            await _enqueue_alerts(agent_id, changed)
+        # Solo con las alertas ya encoladas en Redis damos el cambio por procesado
+        await _save_fingerprints(agent_id, fingerprints)
+
+    except Exception as e:
+        print(f"❌ Error evaluando búsquedas guardadas: {e}")
+
+    finally:
+        try:
+            # Solo soltamos el lock si sigue siendo nuestro (pudo expirar y tomarlo otro)
+            if await redis_client.get(lock_key) == lock_token:
+                await redis_client.delete(lock_key)
+        except Exception:
+            pass
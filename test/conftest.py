@@ -0,0 +1,20 @@
+import sys
+import pytest
+import fakeredis
+
+import app.main  # noqa: F401  (carga todos los módulos que usan redis_client)
+from app.core import cache
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    Reemplaza el redis_client de todos los módulos de la app por un fakeredis
+    en memoria (cada test arranca con Redis vacío y el circuito cerrado).
+    """
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    for name, module in list(sys.modules.items()):
+        if name.startswith("app.") and hasattr(module, "redis_client"):
+            monkeypatch.setattr(module, "redis_client", client)
+    monkeypatch.setattr(cache, "breaker", cache.CircuitBreaker(cache.breaker.failure_threshold, cache.breaker.reset_seconds))
+    return client
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from app.services import availability_index as idx
+
+CAL = "asesor@gmail.com"
+AGENT = next(iter(idx.TENANTS))
+
+
+def at(day, hour):
+    return idx.BOGOTA_TZ.localize(datetime.combine(day, datetime.min.time().replace(hour=hour)))
+
+
+def event(event_id, start, end, **extra):
+    return {"id": event_id, "start": {"dateTime": start.isoformat()}, "end": {"dateTime": end.isoformat()}, **extra}
+
+
+def test_free_slots_skips_overlapping_busy_blocks():
+    day = datetime(2026, 10, 20).date()
+    slots = idx.free_slots(day, [(at(day, 10), at(day, 12))])
+    hours = [s.hour for s in slots]
+    assert hours == [9, 12, 13, 14, 15, 16]
+
+
+def test_dates_covered_is_clipped_to_horizon():
+    today = datetime.now(idx.BOGOTA_TZ).date()
+    horizon = [today + timedelta(days=i) for i in range(3)]
+    # Evento de 10 días que empezó ayer: solo cuentan los 3 días del horizonte
+    assert idx._dates_covered(at(today - timedelta(days=1), 0), at(today + timedelta(days=9), 0), horizon) == horizon
+    # Evento que termina justo a medianoche no toca el día siguiente
+    assert idx._dates_covered(at(today, 10), at(today + timedelta(days=1), 0), horizon) == [today]
+
+
+def test_all_day_and_transparent_events():
+    assert idx._event_interval({"status": "cancelled"}) is None
+    assert idx._event_interval({"transparency": "transparent", "start": {"date": "2026-10-20"}}) is None
+    start, end = idx._event_interval({"start": {"date": "2026-10-20"}, "end": {"date": "2026-10-21"}})
+    assert end - start == timedelta(days=1)
+
+
+@pytest.fixture
+def calendar_api(monkeypatch, fake_redis):
+    """Calendar falso: lista fija para la sync completa y cambios para la incremental."""
+    api = {"full": [], "changes": [], "calls": []}
+
+    class FakeList:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+    class FakeService:
+        def events(self):
+            return self
+
+        def list(self, **kwargs):
+            return FakeList(**kwargs)
+
+    async def fake_execute(creds_file, service_name, version, build_request):
+        request = build_request(FakeService())
+        api["calls"].append(request.kwargs)
+        items = api["changes"] if "syncToken" in request.kwargs else api["full"]
+        return {"items": items, "nextSyncToken": f"token{len(api['calls'])}"}
+
+    monkeypatch.setattr(idx.google_batch, "execute", fake_execute)
+    monkeypatch.setattr(idx, "CALENDAR_WEBHOOK_URL", "https://example.com/webhook/calendar")
+    monkeypatch.setattr(idx, "CALENDAR_WEBHOOK_TOKEN", "secreto")
+    return api
+
+
+def test_incremental_sync_rebuilds_only_affected_days(calendar_api, monkeypatch, fake_redis):
+    tomorrow = datetime.now(idx.BOGOTA_TZ).date() + timedelta(days=1)
+    later = tomorrow + timedelta(days=3)
+    calendar_api["full"] = [
+        event("a", at(tomorrow, 9), at(tomorrow, 10)),
+        event("b", at(later, 14), at(later, 15)),
+    ]
+
+    async def main():
+        await idx.full_sync(AGENT, CAL)
+        await fake_redis.set(f"availidx:horizon:{CAL}", idx._horizon()[-1].isoformat())
+        assert [s.hour for s in await idx.get_free_slots(CAL, tomorrow)][0] == 10
+
+        rebuilt = []
+        original = idx._rebuild_days
+
+        async def spy(calendar_id, days):
+            rebuilt.append(list(days))
+            await original(calendar_id, days)
+
+        monkeypatch.setattr(idx, "_rebuild_days", spy)
+
+        # El evento 'a' se cancela: solo se recalcula mañana
+        calendar_api["changes"] = [{"id": "a", "status": "cancelled"}]
+        await idx.incremental_sync(AGENT, CAL)
+        assert rebuilt == [[tomorrow]]
+        assert [s.hour for s in await idx.get_free_slots(CAL, tomorrow)][0] == 9
+        assert 14 not in [s.hour for s in await idx.get_free_slots(CAL, later)]
+        assert await fake_redis.hget(f"availidx:events:{CAL}", "a") is None
+        assert calendar_api["calls"][-1]["syncToken"] == "token1"
+
+    asyncio.run(main())
+
+
+def test_index_disabled_without_token(monkeypatch, fake_redis):
+    monkeypatch.setattr(idx, "CALENDAR_WEBHOOK_URL", "https://example.com/webhook/calendar")
+    monkeypatch.setattr(idx, "CALENDAR_WEBHOOK_TOKEN", None)
+    today = datetime.now(idx.BOGOTA_TZ).date()
+    assert asyncio.run(idx.get_free_slots(CAL, today)) is None
@@ -0,0 +1,151 @@
+import asyncio
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+from app.core import cache
+from app.services import availability_index
+
+
+def test_breaker_opens_after_threshold_and_allows_one_trial(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    breaker = cache.CircuitBreaker(failure_threshold=2, reset_seconds=10)
+
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+
+    now[0] += 10
+    assert breaker.allow()        # la llamada de prueba
+    assert not breaker.allow()    # las demás esperan su resultado
+
+    breaker.failure()             # prueba fallida: se vuelve a abrir
+    assert not breaker.allow()
+    now[0] += 10
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_cancelled_trial_releases_half_open(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    breaker = cache.CircuitBreaker(failure_threshold=1, reset_seconds=10)
+    monkeypatch.setattr(cache, "breaker", breaker)
+    breaker.failure()
+    now[0] += 10
+
+    async def cancelled():
+        raise asyncio.CancelledError
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cache.call_redis(cancelled))
+    assert breaker.allow()
+
+
+class _DownRedis:
+    """Cliente que falla en cada comando, para simular una caída de Redis."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __getattr__(self, name):
+        async def command(*args, **kwargs):
+            self.calls += 1
+            raise RedisConnectionError("down")
+        return command
+
+    def pipeline(self, transaction=True):
+        return _DownPipeline(self)
+
+
+class _DownPipeline:
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        self.client.calls += 1
+        raise RedisConnectionError("down")
+
+
+def test_tiered_cache_serves_stale_l1_when_redis_is_down(fake_redis, monkeypatch):
+    monkeypatch.setattr(cache, "breaker", cache.CircuitBreaker(failure_threshold=1, reset_seconds=60))
+    tiered = cache.TieredCache("test_stale", ttl=60, l1_ttl=1)
+
+    async def main():
+        await tiered.set("k", {"v": 1})
+        tiered.l1["k"] = (0, tiered.l1["k"][1])  # vencida en L1
+        down = _DownRedis()
+        monkeypatch.setattr(cache, "redis_client", down)
+        first = await tiered.get("k")
+        second = await tiered.get("k")
+        return first, second, down.calls
+
+    first, second, calls = asyncio.run(main())
+    assert first == second == {"v": 1}
+    assert calls == 1  # la segunda lectura ya no toca Redis (circuito abierto)
+
+
+def test_get_many_reads_l1_then_one_mget(fake_redis, monkeypatch):
+    tiered = cache.TieredCache("test_many", ttl=60)
+
+    async def main():
+        await tiered.set_many({"a": 1, "b": 2, "c": 3})
+        tiered.l1.pop("b")
+        tiered.l1.pop("c")
+        calls = []
+        original_mget = fake_redis.mget
+
+        async def counting_mget(keys):
+            calls.append(list(keys))
+            return await original_mget(keys)
+
+        monkeypatch.setattr(fake_redis, "mget", counting_mget)
+        return await tiered.get_many(["a", "b", "c", "d"]), calls
+
+    values, calls = asyncio.run(main())
+    assert values == {"a": 1, "b": 2, "c": 3}
+    assert calls == [["cache:test_many:v0:b", "cache:test_many:v0:c", "cache:test_many:v0:d"]]
+
+
+def test_get_many_serves_stale_l1_when_redis_is_down(fake_redis, monkeypatch):
+    monkeypatch.setattr(cache, "breaker", cache.CircuitBreaker(failure_threshold=1, reset_seconds=60))
+    tiered = cache.TieredCache("test_many_stale", ttl=60)
+
+    async def main():
+        await tiered.set_many({"a": 1, "b": 2})
+        tiered.l1["a"] = (0, tiered.l1["a"][1])
+        monkeypatch.setattr(cache, "redis_client", _DownRedis())
+        await tiered.set_many({"c": 3})  # sin Redis, queda al menos en L1
+        return await tiered.get_many(["a", "b", "c", "d"])
+
+    assert asyncio.run(main()) == {"a": 1, "b": 2, "c": 3}
+
+
+def test_namespace_invalidation_bumps_version(fake_redis):
+    tiered = cache.TieredCache("test_version", ttl=60)
+
+    async def main():
+        await tiered.set("k", {"v": 1})
+        await tiered.invalidate()
+        tiered.l1.clear()
+        return await tiered.get("k"), await fake_redis.get("cache:ver:test_version")
+
+    value, version = asyncio.run(main())
+    assert value is None
+    assert version == "1"
+
+
+def test_availability_index_falls_back_when_redis_is_down(fake_redis, monkeypatch):
+    from datetime import date
+    monkeypatch.setattr(availability_index, "CALENDAR_WEBHOOK_URL", "https://example.com/webhook/calendar")
+    monkeypatch.setattr(availability_index, "CALENDAR_WEBHOOK_TOKEN", "secreto")
+    monkeypatch.setattr(availability_index, "redis_client", _DownRedis())
+
+    assert asyncio.run(availability_index.get_free_slots("cal", date.today())) is None
+    # Sin Redis, la notificación y la sincronización terminan sin lanzar
+    asyncio.run(availability_index.handle_notification("canal", "exists"))
+    asyncio.run(availability_index.sync_calendar("cal"))
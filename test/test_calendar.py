@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime
+import pytest
+from app.core import google_batch
+from app.services import calendar
+
+
+class _FakeFreebusy:
+    def query(self, body):
+        return ("freebusy", body)
+
+
+class _FakeEvents:
+    def list(self, **kwargs):
+        return ("list", kwargs)
+
+    def insert(self, calendarId, body):
+        return ("insert", body)
+
+
+class _FakeCalendarService:
+    def freebusy(self):
+        return _FakeFreebusy()
+
+    def events(self):
+        return _FakeEvents()
+
+
+class _Events(list):
+    pass
+
+
+@pytest.fixture
+def calendar_events(monkeypatch, fake_redis):
+    """Calendar falso detrás de google_batch: guarda los eventos insertados."""
+    events = _Events()
+    freebusy_calls = []
+
+    def fake_execute_batch(key, items):
+        results = []
+        for build_request, _ in items:
+            kind, payload = build_request(_FakeCalendarService())
+            if kind == "freebusy":
+                freebusy_calls.append(payload)
+                busy = [{"start": e["start"]["dateTime"], "end": e["end"]["dateTime"]} for e in events]
+                results.append(({"calendars": {"cal@gmail.com": {"busy": busy}}}, None))
+            elif kind == "list":
+                start = datetime.fromisoformat(payload["timeMin"])
+                end = datetime.fromisoformat(payload["timeMax"])
+                overlapping = [e for e in events if datetime.fromisoformat(e["start"]["dateTime"]) < end
+                               and datetime.fromisoformat(e["end"]["dateTime"]) > start]
+                results.append(({"items": overlapping}, None))
+            else:
+                events.append(payload)
+                results.append(({"id": str(len(events))}, None))
+        return results
+
+    monkeypatch.setattr(google_batch, "_execute_batch", fake_execute_batch)
+    monkeypatch.setitem(calendar.TENANTS, "agent_test", {"creds_file": "creds.json", "calendar_id": "cal@gmail.com"})
+    monkeypatch.setattr(calendar.availability_index, "CALENDAR_WEBHOOK_URL", None)
+    events.freebusy_calls = freebusy_calls
+    return events
+
+
+def _booking(nombre):
+    return {"fecha_hora_inicio": "2030-01-15T10:00:00", "cliente_nombre": nombre, "cliente_telefono": "3001234567"}
+
+
+def test_concurrent_bookings_for_same_slot_create_one_event(calendar_events):
+    async def main():
+        return await asyncio.gather(
+            calendar.create_event_and_lock("agent_test", _booking("Ana")),
+            calendar.create_event_and_lock("agent_test", _booking("Luis")),
+        )
+
+    assert sorted(asyncio.run(main())) == [False, True]
+    assert len(calendar_events) == 1
+
+
+def test_full_day_offers_next_day_with_one_freebusy_query(calendar_events):
+    # Día completo ocupado el 15: se ofrece el 16, consultando los 3 días siguientes juntos
+    calendar_events.append({"start": {"dateTime": "2030-01-15T00:00:00-05:00"},
+                            "end": {"dateTime": "2030-01-16T00:00:00-05:00"}})
+
+    async def main():
+        first = await calendar.check_availability("agent_test", "2030-01-15")
+        second = await calendar.check_availability("agent_test", "2030-01-15")
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == second
+    assert first.startswith("Agenda llena para ese día. El 2030-01-16 hay:")
+    # Una consulta para el día pedido y otra para los siguientes; la segunda vez todo sale de caché
+    assert len(calendar_events.freebusy_calls) == 2
+    assert calendar_events.freebusy_calls[1]["timeMin"].startswith("2030-01-16")
+    assert calendar_events.freebusy_calls[1]["timeMax"].startswith("2030-01-18")
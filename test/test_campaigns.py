@@ -0,0 +1,183 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+import pytest
+from app.services import campaigns
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Reemplaza el envío a Meta y devuelve la lista de mensajes 'enviados'."""
+    messages = []
+
+    async def fake_send_whatsapp(to, template, params, token, phone_id):
+        messages.append((to, params))
+        await asyncio.sleep(0.01)
+        return {"ok": True, "status": 200, "id": f"wamid.{len(messages)}"}
+
+    monkeypatch.setenv("WHATSAPP_TOKEN", "token")
+    monkeypatch.setenv("WHATSAPP_PHONE_ID", "phone")
+    monkeypatch.setattr(campaigns, "send_whatsapp", fake_send_whatsapp)
+    monkeypatch.setattr(campaigns, "_limiter", campaigns.RateLimiter(1000))
+    return messages
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = campaigns.RateLimiter(20)
+
+    async def main():
+        start = time.monotonic()
+        await asyncio.gather(*(limiter.wait() for _ in range(5)))
+        return time.monotonic() - start
+
+    # 5 llamadas a 20/s: la última sale ~0.2s después de la primera
+    assert asyncio.run(main()) >= 0.19
+
+
+def test_concurrent_runs_send_each_recipient_once(fake_redis, sent):
+    recipients = [{"to": f"57300000000{i}", "params": [str(i)]} for i in range(5)]
+
+    async def main():
+        return await asyncio.gather(*(
+            campaigns.send_campaign("c1", "plantilla", recipients) for _ in range(3)
+        ))
+
+    reports = asyncio.run(main())
+    assert sorted(to for to, _ in sent) == sorted(r["to"] for r in recipients)
+    assert any(r["sent"] == 5 for r in reports)
+
+
+def test_rerun_skips_processed_recipients(fake_redis, sent):
+    recipients = [{"to": "573000000001"}, {"to": "573000000002"}]
+    asyncio.run(campaigns.send_campaign("c1", "plantilla", recipients[:1]))
+    report = asyncio.run(campaigns.send_campaign("c1", "plantilla", recipients))
+    assert [to for to, _ in sent] == ["573000000001", "573000000002"]
+    assert report["sent"] == 2
+    assert set(report["results"]) == {"573000000001", "573000000002"}
+
+
+def test_same_number_with_different_ids_gets_both_messages(fake_redis, sent):
+    recipients = [
+        {"id": "a", "to": "573000000001", "params": ["24h"]},
+        {"id": "b", "to": "573000000001", "params": ["1h"]},
+    ]
+    report = asyncio.run(campaigns.send_campaign("c1", "plantilla", recipients))
+    assert len(sent) == 2
+    assert report["results"]["a"]["to"] == "573000000001"
+    assert set(report["results"]) == {"a", "b"}
+
+
+def _reminder(cita: datetime, offset_hours=1):
+    return json.dumps({
+        "agent_id": "agent",
+        "to": "573000000001",
+        "params": ["Ana"],
+        "offset_hours": offset_hours,
+        "cita": cita.strftime("%Y-%m-%dT%H:%M:%S"),
+    }, sort_keys=True)
+
+
+def test_due_reminders_are_sent_and_cleared(fake_redis, sent):
+    cita = datetime.now(campaigns.BOGOTA_TZ).replace(tzinfo=None) + timedelta(minutes=30)
+    member = _reminder(cita)
+
+    async def main():
+        await fake_redis.zadd(campaigns.REMINDERS_KEY, {member: time.time() - 1})
+        await campaigns.dispatch_due_reminders()
+
+    asyncio.run(main())
+    assert len(sent) == 1
+    assert asyncio.run(fake_redis.zcard(campaigns.REMINDERS_KEY)) == 0
+    assert asyncio.run(fake_redis.zcard(campaigns.REMINDERS_PROCESSING_KEY)) == 0
+
+
+def test_reminders_for_past_citas_are_dropped(fake_redis, sent):
+    cita = datetime.now(campaigns.BOGOTA_TZ).replace(tzinfo=None) - timedelta(hours=2)
+
+    async def main():
+        await fake_redis.zadd(campaigns.REMINDERS_KEY, {_reminder(cita): time.time() - 1})
+        await campaigns.dispatch_due_reminders()
+
+    asyncio.run(main())
+    assert sent == []
+    assert asyncio.run(fake_redis.zcard(campaigns.REMINDERS_PROCESSING_KEY)) == 0
+
+
+def test_in_flight_reminders_are_requeued_without_resending(fake_redis, sent):
+    cita = datetime.now(campaigns.BOGOTA_TZ).replace(tzinfo=None) + timedelta(minutes=30)
+    pending, already_sent = _reminder(cita, 1), _reminder(cita, 2)
+
+    async def main():
+        # Simula un proceso que murió: dos reclamados, uno alcanzó a enviarse
+        await fake_redis.zadd(campaigns.REMINDERS_PROCESSING_KEY, {pending: 1, already_sent: 1})
+        reminder = json.loads(already_sent)
+        await fake_redis.hset(
+            f"campaign:recordatorios:{reminder['cita'][:10]}:results",
+            campaigns._reminder_id(reminder),
+            json.dumps({"ok": True, "to": reminder["to"]}),
+        )
+        await campaigns.requeue_reminders()
+        await campaigns.dispatch_due_reminders()
+
+    asyncio.run(main())
+    assert len(sent) == 1
+    assert asyncio.run(fake_redis.zcard(campaigns.REMINDERS_PROCESSING_KEY)) == 0
+
+
+def test_reminder_with_abandoned_claim_is_retried_after_lease(fake_redis, sent):
+    cita = datetime.now(campaigns.BOGOTA_TZ).replace(tzinfo=None) + timedelta(minutes=30)
+    member = _reminder(cita)
+    reminder = json.loads(member)
+    claim_key = f"campaign:recordatorios:{reminder['cita'][:10]}:claim:{campaigns._reminder_id(reminder)}"
+
+    async def main():
+        # Un proceso reclamó el recordatorio y murió antes de guardar el resultado
+        await fake_redis.set(claim_key, "1", ex=campaigns.CLAIM_LEASE_SECONDS)
+        await fake_redis.zadd(campaigns.REMINDERS_PROCESSING_KEY, {member: time.time()})
+
+        await campaigns.requeue_reminders()
+        await campaigns.dispatch_due_reminders()
+        assert sent == []
+        # Mientras el reclamo siga vigente no se reintenta
+        await campaigns.requeue_reminders(older_than=campaigns.STALE_PROCESSING_SECONDS)
+        assert await fake_redis.zcard(campaigns.REMINDERS_PROCESSING_KEY) == 1
+
+        # El reclamo expira y el loop lo devuelve a la cola
+        await fake_redis.delete(claim_key)
+        stale = time.time() - campaigns.STALE_PROCESSING_SECONDS - 1
+        await fake_redis.zadd(campaigns.REMINDERS_PROCESSING_KEY, {member: stale})
+        await campaigns.requeue_reminders(older_than=campaigns.STALE_PROCESSING_SECONDS)
+        await campaigns.dispatch_due_reminders()
+
+    asyncio.run(main())
+    assert len(sent) == 1
+    assert asyncio.run(fake_redis.zcard(campaigns.REMINDERS_PROCESSING_KEY)) == 0
+    assert asyncio.run(fake_redis.zcard(campaigns.REMINDERS_KEY)) == 0
+
+
+def test_campaign_job_left_in_processing_is_resumed(fake_redis, sent):
+    job = json.dumps({"campaign_id": "c1", "template": "plantilla",
+                      "recipients": [{"to": "573000000001"}, {"to": "573000000002"}]}, sort_keys=True)
+
+    async def main():
+        # Un proceso reclamó el job, alcanzó a enviar el primero y murió
+        await fake_redis.zadd(campaigns.CAMPAIGN_JOBS_PROCESSING_KEY, {job: time.time()})
+        await fake_redis.hset("campaign:c1:results", "573000000001", json.dumps({"ok": True, "to": "573000000001"}))
+        await campaigns.requeue_campaign_jobs()
+        await campaigns.dispatch_campaign_jobs()
+
+    asyncio.run(main())
+    assert [to for to, _ in sent] == ["573000000002"]
+    assert asyncio.run(fake_redis.zcard(campaigns.CAMPAIGN_JOBS_KEY)) == 0
+    assert asyncio.run(fake_redis.zcard(campaigns.CAMPAIGN_JOBS_PROCESSING_KEY)) == 0
+
+
+def test_launch_campaign_persists_and_sends(fake_redis, sent):
+    async def main():
+        await campaigns.launch_campaign("c1", "plantilla", [{"to": "573000000001"}])
+        await asyncio.gather(*campaigns._background_tasks)
+
+    asyncio.run(main())
+    assert [to for to, _ in sent] == ["573000000001"]
+    assert asyncio.run(fake_redis.zcard(campaigns.CAMPAIGN_JOBS_PROCESSING_KEY)) == 0
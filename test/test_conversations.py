@@ -0,0 +1,101 @@
+import asyncio
+import json
+from app.services import conversations
+
+
+def test_normalize_phone():
+    assert conversations.normalize_phone("+57 300 123 4567") == "573001234567"
+    assert conversations.normalize_phone("3001234567") == "573001234567"
+    assert conversations.normalize_phone("1 (555) 010-9999") == "15550109999"
+    assert conversations.normalize_phone(None) == ""
+
+
+def test_contact_names_by_wa_id():
+    contacts = [
+        {"wa_id": "573001111111", "profile": {"name": "Ana"}},
+        {"wa_id": "573002222222", "profile": {"name": "Luis"}},
+    ]
+    names = conversations.contact_names(contacts)
+    assert names == {"573001111111": "Ana", "573002222222": "Luis"}
+
+
+def _message(sender, msg_id, text):
+    return {"from": sender, "id": msg_id, "type": "text", "timestamp": "1", "text": {"body": text}}
+
+
+async def _drain(shard=0, timeout=3):
+    """Corre el worker del shard hasta vaciar su cola."""
+    task = asyncio.create_task(conversations._worker(shard))
+    redis = conversations.redis_client
+    try:
+        for _ in range(int(timeout / 0.05)):
+            await asyncio.sleep(0.05)
+            if not await redis.llen(f"wa:inbox:{shard}") and not await redis.llen(f"wa:inbox:{shard}:processing"):
+                return
+    finally:
+        task.cancel()
+
+
+def test_messages_are_persisted_and_processed_in_order(fake_redis, monkeypatch):
+    monkeypatch.setattr(conversations, "WA_INBOUND_WORKERS", 1)
+
+    async def main():
+        for i in range(3):
+            await conversations.receive(_message("573001111111", f"wamid.{i}", f"hola {i}"), "Ana")
+        assert await fake_redis.llen("wa:inbox:0") == 3
+        await _drain()
+
+    asyncio.run(main())
+    history = asyncio.run(fake_redis.lrange("wa:conv:573001111111:history", 0, -1))
+    assert [json.loads(h)["txt"] for h in history] == ["hola 2", "hola 1", "hola 0"]
+    conv = asyncio.run(fake_redis.hgetall("wa:conv:573001111111"))
+    assert conv["nombre"] == "Ana"
+    assert conv["message_count"] == "3"
+
+
+def test_duplicate_wamid_is_processed_once(fake_redis, monkeypatch):
+    monkeypatch.setattr(conversations, "WA_INBOUND_WORKERS", 1)
+
+    async def main():
+        for _ in range(2):
+            await conversations.receive(_message("573001111111", "wamid.1", "hola"))
+        await _drain()
+
+    asyncio.run(main())
+    assert asyncio.run(fake_redis.hget("wa:conv:573001111111", "message_count")) == "1"
+
+
+def test_failed_message_is_retried_before_later_ones(fake_redis, monkeypatch):
+    monkeypatch.setattr(conversations, "WA_INBOUND_WORKERS", 1)
+    original = conversations.process_message
+    attempts = []
+
+    async def flaky(message, contact_name=None):
+        attempts.append(message["id"])
+        if attempts.count("wamid.0") == 1 and message["id"] == "wamid.0":
+            raise RuntimeError("falla temporal")
+        await original(message, contact_name)
+
+    monkeypatch.setattr(conversations, "process_message", flaky)
+
+    async def main():
+        await conversations.receive(_message("573001111111", "wamid.0", "primero"))
+        await conversations.receive(_message("573001111111", "wamid.1", "segundo"))
+        await _drain()
+
+    asyncio.run(main())
+    assert attempts == ["wamid.0", "wamid.0", "wamid.1"]
+    assert asyncio.run(fake_redis.exists("wa:msg:wamid.0")) == 1
+
+
+def test_in_flight_messages_are_requeued_on_start(fake_redis, monkeypatch):
+    monkeypatch.setattr(conversations, "WA_INBOUND_WORKERS", 1)
+
+    async def main():
+        # Simula un reinicio con un mensaje a medio procesar
+        item = {"message": _message("573001111111", "wamid.9", "pendiente"), "nombre": None, "intentos": 0}
+        await fake_redis.rpush("wa:inbox:0:processing", json.dumps(item))
+        await _drain()
+
+    asyncio.run(main())
+    assert asyncio.run(fake_redis.hget("wa:conv:573001111111", "last_text")) == "pendiente"
@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from app.core import dedupe
+
+
+def test_args_hash_ignores_key_order_and_identity_fields():
+    a = {"ciudad": "Bogotá", "presupuesto_max": 300, "call": {"call_id": "c1"}}
+    b = {"presupuesto_max": 300, "ciudad": "Bogotá", "call_id": "c2", "name": "x"}
+    assert dedupe.args_hash(a) == dedupe.args_hash(b)
+    assert dedupe.args_hash(a) != dedupe.args_hash({"ciudad": "Cali", "presupuesto_max": 300})
+
+
+def test_get_call_id():
+    assert dedupe.get_call_id({"call": {"call_id": "abc"}}) == "abc"
+    assert dedupe.get_call_id({"call_id": "xyz"}) == "xyz"
+    assert dedupe.get_call_id({"ciudad": "Cali"}) is None
+
+
+def _counting_execute(calls, result, delay=0.01):
+    async def execute():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result
+    return execute
+
+
+def test_concurrent_duplicates_share_one_execution(fake_redis):
+    calls = []
+    execute = _counting_execute(calls, {"result": "ok"})
+
+    async def main():
+        return await asyncio.gather(*(
+            dedupe.run_once("search_inventory", "c1", {"ciudad": "Cali"}, execute) for _ in range(5)
+        ))
+
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert results == [{"result": "ok"}] * 5
+
+
+def test_retry_is_replayed_from_redis(fake_redis):
+    calls = []
+    execute = _counting_execute(calls, {"result": "ok"})
+
+    async def main():
+        await dedupe.run_once("search_inventory", "c1", {"ciudad": "Cali"}, execute)
+        return await dedupe.run_once("search_inventory", "c1", {"ciudad": "Cali"}, execute)
+
+    assert asyncio.run(main()) == {"result": "ok"}
+    assert calls == [1]
+
+
+def test_no_replay_without_call_id(fake_redis):
+    calls = []
+    execute = _counting_execute(calls, {"result": "ok"})
+
+    async def main():
+        await dedupe.run_once("search_inventory", None, {"ciudad": "Cali"}, execute)
+        await dedupe.run_once("search_inventory", None, {"ciudad": "Cali"}, execute)
+
+    asyncio.run(main())
+    assert calls == [1, 1]
+
+
+def test_availability_is_never_replayed(fake_redis):
+    calls = []
+    execute = _counting_execute(calls, {"result": "Horarios disponibles: 09:00 AM."})
+
+    async def main():
+        await dedupe.run_once("check_calendar_availability", "c1", {"fecha": "2026-10-20"}, execute)
+        await dedupe.run_once("check_calendar_availability", "c1", {"fecha": "2026-10-20"}, execute)
+
+    asyncio.run(main())
+    assert calls == [1, 1]
+
+
+def test_non_cacheable_result_is_not_stored(fake_redis):
+    calls = []
+    execute = _counting_execute(calls, {"result": "Ese horario ya está ocupado."})
+    args = {"cliente_telefono": "3001234567", "fecha_hora_inicio": "2026-10-20T10:00:00"}
+
+    async def main():
+        for _ in range(2):
+            await dedupe.run_once("book_appointment_and_notify", "c1", args, execute, cacheable=lambda r: False)
+
+    asyncio.run(main())
+    assert calls == [1, 1]
+
+
+def test_waiter_takes_over_when_leader_is_cancelled(fake_redis):
+    calls = []
+
+    async def execute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"result": "ok"}
+
+    async def main():
+        leader = asyncio.create_task(dedupe.run_once("search_inventory", "c1", {"ciudad": "Cali"}, execute))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(dedupe.run_once("search_inventory", "c1", {"ciudad": "Cali"}, execute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(main()) == {"result": "ok"}
+    assert calls == [1, 1]
+
+
+def test_only_successful_bookings_are_replayable():
+    from app.main import is_replayable, BOOKING_OK_MESSAGE
+    assert is_replayable("book_appointment_and_notify", {"result": BOOKING_OK_MESSAGE})
+    assert not is_replayable("book_appointment_and_notify", {"result": "Ese horario ya está ocupado."})
+    assert is_replayable("search_inventory", {"result": "Encontré 2 opciones."})
@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+from app.core import google_batch
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Reemplaza el envío real: cada lote devuelve lo que construye cada petición."""
+    sent = []
+
+    def fake_execute_batch(key, items):
+        sent.append((key, len(items)))
+        results = []
+        for build_request, _ in items:
+            try:
+                results.append((build_request(None), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    monkeypatch.setattr(google_batch, "_execute_batch", fake_execute_batch)
+    return sent
+
+
+def test_concurrent_requests_share_one_batch(batches):
+    async def main():
+        return await asyncio.gather(*(
+            google_batch.execute("creds.json", "calendar", "v3", lambda svc, i=i: {"n": i}) for i in range(5)
+        ))
+
+    assert asyncio.run(main()) == [{"n": i} for i in range(5)]
+    assert batches == [(("creds.json", "calendar", "v3"), 5)]
+
+
+def test_requests_are_grouped_per_tenant_and_api(batches):
+    async def main():
+        await asyncio.gather(
+            google_batch.execute("a.json", "calendar", "v3", lambda svc: 1),
+            google_batch.execute("b.json", "calendar", "v3", lambda svc: 2),
+            google_batch.execute("a.json", "sheets", "v4", lambda svc: 3),
+        )
+
+    asyncio.run(main())
+    assert len(batches) == 3
+
+
+def test_errors_reach_only_their_caller(batches):
+    def broken(svc):
+        raise ValueError("mala petición")
+
+    async def main():
+        return await asyncio.gather(
+            google_batch.execute("a.json", "calendar", "v3", lambda svc: "ok"),
+            google_batch.execute("a.json", "calendar", "v3", broken),
+            return_exceptions=True,
+        )
+
+    ok, error = asyncio.run(main())
+    assert ok == "ok"
+    assert isinstance(error, ValueError)
+
+
+def test_full_batch_is_sent_without_waiting(batches, monkeypatch):
+    monkeypatch.setattr(google_batch, "GOOGLE_BATCH_MAX_SIZE", 2)
+
+    async def main():
+        await asyncio.gather(*(
+            google_batch.execute("a.json", "calendar", "v3", lambda svc: 1) for _ in range(3)
+        ))
+
+    asyncio.run(main())
+    assert [size for _, size in batches] == [2, 1]
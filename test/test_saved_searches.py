@@ -0,0 +1,122 @@
+import asyncio
+import json
+import pytest
+from app.services import saved_searches
+
+
+AGENT = "agent"
+
+
+def _search(phone, ciudad="Medellín", presupuesto=None, zona=None, operacion="Venta", nombre="Ana"):
+    args = {"cliente_telefono": phone, "ciudad": ciudad, "tipo_operacion": operacion, "cliente_nombre": nombre}
+    if presupuesto is not None:
+        args["presupuesto_max"] = presupuesto
+    if zona:
+        args["zona_ciudad"] = zona
+    return saved_searches.save_search(AGENT, args)
+
+
+def _listing(**kwargs):
+    row = {"codigo": "P1", "tipo_operacion": "Venta", "ciudad": "Medellin", "zona_ciudad": "El Poblado",
+           "precio_total_cop": 400_000_000}
+    row.update(kwargs)
+    return row
+
+
+def test_match_by_city_budget_and_zone(fake_redis):
+    async def main():
+        await _search("3001111111", presupuesto=500_000_000)              # cumple
+        await _search("3002222222", presupuesto=300_000_000)              # presupuesto corto
+        await _search("3003333333", ciudad="Cali")                         # otra ciudad
+        await _search("3004444444", zona="Laureles")                       # otra zona
+        await _search("3005555555", zona="poblado", nombre="Luis")         # cumple, sin presupuesto
+        await _search("3006666666", operacion="Arriendo")                  # otra operación
+        return await saved_searches.match_listings(AGENT, [_listing()])
+
+    matches = asyncio.run(main())
+    assert set(matches) == {"573001111111", "573005555555"}
+    assert matches["573005555555"]["cliente_nombre"] == "Luis"
+
+
+def test_new_search_replaces_previous_index(fake_redis):
+    async def main():
+        await _search("3001111111", ciudad="Cali")
+        await _search("3001111111", ciudad="Medellín")
+        return await saved_searches.match_listings(AGENT, [_listing(ciudad="Cali")])
+
+    assert asyncio.run(main()) == {}
+    assert asyncio.run(fake_redis.zcard(f"ss:{AGENT}:idx:venta:cali")) == 0
+
+
+def test_search_without_phone_is_not_saved(fake_redis):
+    asyncio.run(saved_searches.save_search(AGENT, {"ciudad": "Cali"}))
+    assert asyncio.run(fake_redis.keys("ss:*")) == []
+
+
+@pytest.fixture
+def launched(monkeypatch):
+    campaigns = []
+
+    async def fake_launch_campaign(campaign_id, template, recipients):
+        campaigns.append(recipients)
+
+    monkeypatch.setattr(saved_searches.campaigns, "launch_campaign", fake_launch_campaign)
+    return campaigns
+
+
+def test_refresh_alerts_only_changed_listings(fake_redis, launched):
+    async def main():
+        await _search("3001111111", presupuesto=500_000_000)
+        await saved_searches.on_inventory_refresh(AGENT, [_listing(precio_total_cop=600_000_000)])  # línea base
+        await saved_searches.on_inventory_refresh(AGENT, [_listing()])  # bajó de precio
+
+    asyncio.run(main())
+    assert len(launched) == 1
+    assert [r["to"] for r in launched[0]] == ["573001111111"]
+
+
+def test_concurrent_refreshes_alert_once(fake_redis, launched):
+    async def main():
+        await _search("3001111111", presupuesto=500_000_000)
+        await saved_searches.on_inventory_refresh(AGENT, [_listing(precio_total_cop=600_000_000)])
+        await asyncio.gather(*(saved_searches.on_inventory_refresh(AGENT, [_listing()]) for _ in range(3)))
+
+    asyncio.run(main())
+    assert len(launched) == 1
+
+
+def test_failed_matching_keeps_change_for_next_refresh(fake_redis, launched, monkeypatch):
+    original = saved_searches.match_listings
+
+    async def failing_match(agent_id, listings):
+        raise RuntimeError("falla temporal")
+
+    async def main():
+        await _search("3001111111", presupuesto=500_000_000)
+        await saved_searches.on_inventory_refresh(AGENT, [_listing(precio_total_cop=600_000_000)])
+        monkeypatch.setattr(saved_searches, "match_listings", failing_match)
+        await saved_searches.on_inventory_refresh(AGENT, [_listing()])
+        monkeypatch.setattr(saved_searches, "match_listings", original)
+        await saved_searches.on_inventory_refresh(AGENT, [_listing()])
+
+    asyncio.run(main())
+    assert [[r["to"] for r in recipients] for recipients in launched] == [["573001111111"]]
+
+
+def test_alerts_are_persisted_as_campaign_jobs(fake_redis, monkeypatch):
+    async def no_dispatch():
+        pass
+
+    monkeypatch.setattr(saved_searches.campaigns, "dispatch_campaign_jobs", no_dispatch)
+
+    async def main():
+        await _search("3001111111", presupuesto=500_000_000)
+        await saved_searches.on_inventory_refresh(AGENT, [_listing(precio_total_cop=600_000_000)])
+        await saved_searches.on_inventory_refresh(AGENT, [_listing()])
+        await asyncio.sleep(0)
+        return await fake_redis.zrange(saved_searches.campaigns.CAMPAIGN_JOBS_KEY, 0, -1)
+
+    jobs = [json.loads(j) for j in asyncio.run(main())]
+    assert len(jobs) == 1
+    assert jobs[0]["campaign_id"].startswith(f"nuevas:{AGENT}:")
+    assert [r["to"] for r in jobs[0]["recipients"]] == ["573001111111"]